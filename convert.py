@@ -9,6 +9,8 @@ import os
 import subprocess as sp
 import sys
 
+from hxtool.protocol import Message, MessageDecoder, ProtocolError
+
 if not len(sys.argv) == 3:
     sys.stderr.write("usage: %s print|dump <file_name>\n" % os.path.basename(sys.argv[0]))
     sys.exit(1)
@@ -59,21 +61,31 @@ if mode == "print":
         print("%s %s%s" % (dev, "> " if direction == "0" else "  < ", repr(string)[1:-1]))
 
 elif mode == "dump":
+    # Messages may be split across USB transfers, so decode each stream incrementally
+    decoders = {}
     start_address = None
     prev_address = None
     for dev, direction, string in protocol:
-        for cmd in string.split("\n"):
-            if cmd.startswith("#CFLWR") or cmd.startswith("#CEPDT"):
-                c = cmd.split("\t")
-                address = int(c[1], 16)
-                length = int(c[2], 16)
+        decoder = decoders.setdefault((dev, direction), MessageDecoder())
+        items = decoder.feed(string.encode("utf-8"))
+        while True:
+            try:
+                cmd = next(items)
+            except StopIteration:
+                break
+            except ProtocolError as e:
+                sys.stderr.write("WARNING: %s\n" % e)
+                items = decoder.decode()
+                continue
+            if isinstance(cmd, Message) and cmd.type in ("#CFLWR", "#CEPDT"):
+                address = int(cmd.args[0], 16)
+                length = int(cmd.args[1], 16)
                 if start_address is None:
                     start_address = address
                     sys.stderr.write("INFO: start address 0x%08x\n" % start_address)
                 if prev_address is not None:
                     if address != prev_address + length:
                         sys.stderr.write("WARNING: non-continguous address, new address 0x%08x\n" % address)
-                data = binascii.unhexlify(c[3])
+                data = binascii.unhexlify(cmd.args[2])
                 sys.stdout.buffer.write(data)
                 prev_address = address
-
@@ -29,6 +29,19 @@ logger = logging.getLogger(__name__)
 
 def get(args):
     """Select a single device according to arguments"""
+    if getattr(args, "device", None) is not None:
+        return args.device  # preselected in batch mode
+
+    if args.tty is None and args.model is None:
+        # Only the selected device is connected to, no matter how many are attached
+        handles = device.list_devices(add_simulator=args.simulator)
+        if len(handles) == 0:
+            logger.critical("No device detected. Connect device or try specifying --tty")
+            return None
+        if len(handles) > 1:
+            logger.warning(f"Multiple devices detected, using {handles[0].tty}")
+        return handles[0].connect()
+
     devices = device.enumerate(force_model=args.model, force_device=args.tty, add_simulator=args.simulator)
 
     if len(devices) == 0:
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from json import dumps, load
+from logging import getLogger
+from os import environ, fdopen, makedirs, path, remove, replace
+from re import sub
+from tempfile import mkstemp
+from threading import Lock
+
+logger = getLogger(__name__)
+
+
+def cache_dir(*parts) -> str:
+    """Per-user hxtool cache directory according to the XDG base directory spec"""
+    base = environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    return path.join(base, "hxtool", *parts)
+
+
+def cache_key(*parts) -> str:
+    """Build file name-safe cache key from parts like flash ID and MMSI"""
+    return "_".join(sub(r"[^0-9A-Za-z.-]", "", str(part)) or "none" for part in parts)
+
+
+def write_atomically(file_name: str, data: bytes) -> None:
+    """Replace file in one go, so an interrupted write never leaves a truncated cache behind"""
+    directory = path.dirname(file_name)
+    makedirs(directory, exist_ok=True)
+    # Unique temp file, so concurrent writers of the same file don't clobber each other's data
+    fd, temp_file_name = mkstemp(dir=directory, prefix=path.basename(file_name) + ".", suffix=".tmp")
+    try:
+        with fdopen(fd, "wb") as f:
+            f.write(data)
+        replace(temp_file_name, file_name)
+    except BaseException:
+        if path.exists(temp_file_name):
+            remove(temp_file_name)
+        raise
+
+
+class GpsLogCache(object):
+    """
+    Raw GPS log last read from a radio, along with the log status it was read with
+
+    The log status reported by the GPS module changes whenever a trackpoint is logged,
+    so an unchanged status means the cached log is still current.
+    """
+
+    def __init__(self, key: str, directory: str or None = None):
+        self.key = key
+        self.directory = directory or cache_dir("gpslog")
+        self.status = None
+        self.data = b""
+        self.load()
+
+    @property
+    def data_file(self) -> str:
+        return path.join(self.directory, f"{self.key}.bin")
+
+    @property
+    def status_file(self) -> str:
+        return path.join(self.directory, f"{self.key}.json")
+
+    def load(self) -> bool:
+        try:
+            with open(self.status_file) as f:
+                meta = load(f)
+            with open(self.data_file, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable GPS log cache for {self.key}: {e}")
+            return False
+        if type(meta) is not dict or meta.get("size") != len(data) or type(meta.get("status")) is not dict:
+            logger.warning(f"Ignoring inconsistent GPS log cache for {self.key}")
+            return False
+        self.status = meta["status"]
+        self.data = data
+        return True
+
+    def is_current(self, status: dict) -> bool:
+        """Whether cached log matches log status read from the radio"""
+        return self.status is not None and self.status == status
+
+    def is_changed(self, offset: int, data: bytes) -> bool:
+        """Whether log data at offset differs from cached log"""
+        return self.data[offset:offset + len(data)] != data
+
+    def store(self, status: dict, data: bytes) -> None:
+        write_atomically(self.data_file, data)
+        meta = {
+            "size": len(data),
+            "status": status
+        }
+        write_atomically(self.status_file, dumps(meta, indent=4).encode("utf-8"))
+        self.status = dict(status)
+        self.data = bytes(data)
+
+    def clear(self) -> None:
+        for file_name in self.status_file, self.data_file:
+            if path.exists(file_name):
+                remove(file_name)
+        self.status = None
+        self.data = b""
+
+
+class DeviceIdentityCache(object):
+    """
+    What was learned about radios on earlier runs, like model, flash ID and firmware version
+
+    Entries are keyed by USB serial number and port location, so a radio is recognized
+    without probing it. Cached answers are only hints and get replaced whenever
+    the radio is seen answering differently.
+    """
+
+    def __init__(self, file_name: str or None = None):
+        self.file_name = file_name or cache_dir("devices.json")
+        self.lock = Lock()  # devices are probed in parallel
+        self.entries = {}
+        self.load()
+
+    @staticmethod
+    def key(port_info) -> str or None:
+        """Cache key for pyserial port info, or None if the port can't be told apart from others"""
+        serial_number = getattr(port_info, "serial_number", None)
+        location = getattr(port_info, "location", None)
+        if serial_number is None and location is None:
+            return None
+        return cache_key(serial_number, location)
+
+    def load(self) -> None:
+        try:
+            with open(self.file_name) as f:
+                entries = load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable device cache: {e}")
+            return
+        if type(entries) is not dict:
+            logger.warning("Ignoring inconsistent device cache")
+            return
+        self.entries = {key: entry for key, entry in entries.items() if type(entry) is dict}
+
+    def get(self, key: str or None) -> dict:
+        with self.lock:
+            return dict(self.entries.get(key, {})) if key is not None else {}
+
+    def update(self, key: str or None, **identity) -> None:
+        """Merge identity into entry, writing the cache file only if anything changed"""
+        if key is None:
+            return
+        with self.lock:
+            entry = dict(self.entries.get(key, {}))
+            entry.update((name, value) for name, value in identity.items() if value is not None)
+            if entry == self.entries.get(key):
+                return
+            self.entries[key] = entry
+            self.save()
+
+    def invalidate(self, key: str or None) -> None:
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.save()
+
+    def save(self) -> None:
+        try:
+            write_atomically(self.file_name, dumps(self.entries, indent=4, sort_keys=True).encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Unable to write device cache: {e}")
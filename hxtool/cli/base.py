@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from copy import copy
+from io import StringIO
+from json import dumps
 from logging import getLogger
+import sys
+from time import time
+
+from ..device import list_devices
 
 logger = getLogger(__name__)
 
@@ -12,6 +21,8 @@ class CliCommand(object):
 
     name = "Template"
     help = "Just a parent class for CLI commands"
+    batch = False  # whether the command can run on all devices at once
+    output_args = ()  # names of arguments naming output files, which must differ per device in batch mode
 
     @staticmethod
     def setup_args(parser) -> None:
@@ -90,6 +101,13 @@ def run(args) -> int:
     if not current_command.check_args(args):
         return 5
 
+    if getattr(args, "all", False):
+        return run_batch(all_commands[args.command], args)
+
+    return execute(current_command)
+
+
+def execute(current_command) -> int:
     try:
         logger.debug("Running command .setup()")
         if not current_command.setup():
@@ -107,3 +125,117 @@ def run(args) -> int:
     current_command.teardown()
 
     return result
+
+
+class ThreadOutput(object):
+    """
+    Stand-in for sys.stdout that keeps the output of worker threads apart
+
+    Workers that called capture() write into their own buffer, all others
+    write through to the original stream. The buffer is tracked in a context
+    variable, so work handed to child threads with contextvars.copy_context()
+    is captured along with its worker.
+    """
+
+    buffer = ContextVar("buffer", default=None)
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def capture(self) -> None:
+        self.buffer.set(StringIO())
+
+    def release(self) -> str:
+        output = self.buffer.get().getvalue()
+        self.buffer.set(None)
+        return output
+
+    def write(self, text: str) -> int:
+        return (self.buffer.get() or self.stream).write(text)
+
+    def flush(self) -> None:
+        if self.buffer.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_batch(command_class, args) -> int:
+    """
+    Run command on all detected devices at once, one worker thread per device
+
+    Output of every device is captured and printed as part of a JSON summary
+    along with result and timing. `{device}` in arguments is replaced by the
+    device's numeric selector, to keep output files apart.
+    """
+    if not command_class.batch:
+        logger.critical(f"Command `{command_class.name}` can't run on all devices")
+        return 5
+    if args.tty is not None:
+        logger.critical("Use either --all or --tty")
+        return 5
+
+    handles = list_devices(add_simulator=args.simulator)
+    selectors = list(enumerate(handles))
+    if args.model is not None:
+        selectors = [(index, handle) for index, handle in selectors if handle.model.handle == args.model]
+    if len(selectors) == 0:
+        logger.critical("No device detected. Is it connected?")
+        return 10
+    if len(selectors) > 1:
+        for name in command_class.output_args:
+            value = getattr(args, name, None)
+            if value is not None and "{device}" not in value:
+                logger.critical(f"Output file `{value}` would be shared by all devices, put `{{device}}` in its name")
+                return 5
+
+    output = ThreadOutput(sys.stdout)
+    start = time()
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=len(selectors)) as pool:
+            reports = list(pool.map(lambda selector: run_on_device(command_class, args, *selector, output),
+                                    selectors))
+    finally:
+        sys.stdout = output.stream
+
+    summary = {
+        "command": command_class.name,
+        "seconds": round(time() - start, 3),
+        "devices": reports
+    }
+    print(dumps(summary, indent=4))
+    return max(report["result"] for report in reports)
+
+
+def run_on_device(command_class, args, index: int, handle, output: ThreadOutput) -> dict:
+    device_args = copy(args)
+    for name, value in vars(args).items():
+        if isinstance(value, str) and "{device}" in value:
+            setattr(device_args, name, value.replace("{device}", str(index)))
+    device_args.device = None
+    report = {
+        "device": index,
+        "tty": handle.tty,
+        "model": handle.model.handle,
+        "result": 10,
+        "seconds": None,
+        "error": None,
+        "output": ""
+    }
+    output.capture()
+    start = time()
+    try:
+        device_args.device = handle.connect()
+        report["result"] = execute(command_class(device_args))
+    except Exception as e:
+        # One failing radio must not take down the others
+        logger.error(f"Device {index} on {handle.tty} failed: {e}")
+        report["error"] = str(e) or type(e).__name__
+    finally:
+        report["seconds"] = round(time() - start, 3)
+        report["output"] = output.release()
+        if device_args.device is not None:
+            device_args.device.close()
+    return report
@@ -14,6 +14,8 @@ class InfoCommand(CliCommand):
 
     name = "config"
     help = "read and write handset configuration"
+    batch = True
+    output_args = ("dump",)
 
     @staticmethod
     def setup_args(parser) -> None:
@@ -23,11 +25,44 @@ class InfoCommand(CliCommand):
                             type=abspath,
                             action="store")
 
+        parser.add_argument("--resume",
+                            help="continue an interrupted --dump, reading only missing blocks",
+                            action="store_true")
+
         parser.add_argument("-f", "--flash",
                             help="read config from file and write to handset",
                             type=abspath,
                             action="store")
 
+        parser.add_argument("--diff",
+                            help="only flash blocks that differ from handset config and verify them",
+                            action="store_true")
+
+        parser.add_argument("--base",
+                            help="config dump matching current handset config, saves reading it for --diff",
+                            type=abspath,
+                            action="store")
+
+        parser.add_argument("--window",
+                            help="number of pipelined block reads in flight, values above 1 are experimental "
+                                 "(default: 1)",
+                            type=int,
+                            default=1,
+                            action="store")
+
+    @staticmethod
+    def check_args(args) -> bool:
+        if args.window < 1:
+            logger.critical("Read window must be at least 1")
+            return False
+        if args.resume and args.dump is None:
+            logger.critical("--resume only works with --dump")
+            return False
+        if args.base is not None and not args.diff:
+            logger.critical("--base only works with --diff")
+            return False
+        return True
+
     def run(self):
         hx = hxtool.get(self.args)
         if hx is None:
@@ -45,27 +80,40 @@ class InfoCommand(CliCommand):
 
         if self.args.dump is not None:
             # TODO: warn on flash ID mismatch
-            with open(self.args.dump, "wb") as f:
-                logger.info("Reading config flash from handset")
-                try:
-                    data = hx.config.config_read(progress=True)
-                    logger.info(f"Writing config to `{self.args.dump}`")
-                    f.write(data)
-                except ProtocolError as e:
-                    logger.error(e)
-                    ret = 10
+            logger.info(f"Reading config flash from handset into `{self.args.dump}`")
+            try:
+                hx.config.config_dump(self.args.dump, resume=self.args.resume, progress=True,
+                                      window=self.args.window)
+            except ProtocolError as e:
+                logger.error(e)
+                ret = 10
+
+        if self.args.flash is not None and not hx.verify_model():
+            logger.critical("Device doesn't match its cached model, run again to detect it")
+            return 10
 
         if self.args.flash is not None:
             # TODO: add --really safeguard on flash ID mismatch
             with open(self.args.flash, "rb") as f:
                 logger.info(f"Reading config data from `{self.args.flash}`")
                 data = f.read()
-                logger.info("Writing config to handset")
-                try:
-                    hx.config.config_write(data, progress=True)
-                except ProtocolError as e:
-                    logger.error(e)
-                    ret = 10
+            current = None
+            if self.args.base is not None:
+                with open(self.args.base, "rb") as f:
+                    logger.info(f"Reading current config data from `{self.args.base}`")
+                    current = f.read()
+            logger.info("Writing config to handset")
+            try:
+                report = hx.config.config_write(data, progress=True, diff=self.args.diff, current=current,
+                                                window=self.args.window)
+                logger.info(f"Wrote {report['written']} blocks, skipped {report['skipped']} unchanged blocks")
+                if self.args.diff:
+                    logger.info(f"Verified {report['verified']} written blocks")
+            except ProtocolError as e:
+                logger.error(e)
+                ret = 10
+
+        logger.debug("Protocol statistics: %s", dict(hx.comm.stats))
 
         if ret == 0:
             logger.info("Operation successful")
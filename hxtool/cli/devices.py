@@ -3,7 +3,7 @@
 from logging import getLogger
 
 from .base import CliCommand
-from ..device import enumerate
+from ..device import list_devices, probe
 
 logger = getLogger(__name__)
 
@@ -14,7 +14,10 @@ class DevicesCommand(CliCommand):
     help = "enumerate detected devices"
 
     def run(self):
-        devices = enumerate(add_simulator=self.args.simulator)
+        handles = list_devices(add_simulator=self.args.simulator)
+        devices = probe([(h.model, h.tty) for h in handles])
+        # Selectors are indices into the handle list, so they stay valid if a port fails to answer
+        selectors = {h.tty: i for i, h in enumerate(handles)}
         if len(devices) > 0:
             for device in devices:
                 mode = "unknown mode (BE CAREFUL)"
@@ -24,7 +27,7 @@ class DevicesCommand(CliCommand):
                     mode = "CP mode"
                 if not device.comm.hx_hardware:
                     mode = "unknown hardware (BE CAREFUL)"
-                print(f"[{devices.index(device)}]\t{device.tty}\t{device.brand}\t{device.model}\t{mode}")
+                print(f"[{selectors[device.tty]}]\t{device.tty}\t{device.brand}\t{device.model}\t{mode}")
             return 0
 
         else:
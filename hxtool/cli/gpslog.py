@@ -1,16 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from argparse import ArgumentTypeError
 from binascii import hexlify
+import calendar
 import datetime
-import gpxpy
-import gpxpy.gpx
-from json import dump
 from logging import getLogger
 from os.path import abspath
 
 import hxtool
 from .base import CliCommand
-from hxtool.locus import Locus, LocusError
+from hxtool.cache import cache_key, GpsLogCache
+from hxtool.locus import Locus, LocusError, LocusLog
+from hxtool.logexport import export as export_log, GpxpySink, GpxSink, JsonSink, LogData, LogSink, \
+    TextSink
+from hxtool.protocol import ProtocolError
 
 logger = getLogger(__name__)
 
@@ -19,6 +22,8 @@ class GpsLogCommand(CliCommand):
 
     name = "gpslog"
     help = "dump or clear GPS logger data"
+    batch = True
+    output_args = ("gpx", "json", "ndjson", "raw")
 
     @staticmethod
     def setup_args(parser) -> None:
@@ -26,20 +31,62 @@ class GpsLogCommand(CliCommand):
                             help="file name for GPX export",
                             type=abspath,
                             action="store")
+        parser.add_argument("--segment-gap",
+                            help="start new GPX track segment after time gaps of SEGMENT_GAP seconds "
+                                 f"(default: {GpxSink.segment_gap})",
+                            type=int,
+                            action="store")
+        parser.add_argument("--gpxpy",
+                            help="export GPX through gpxpy, without speed and heading",
+                            action="store_true")
         parser.add_argument("-j", "--json",
                             help="file name for JSON export",
                             type=abspath,
                             action="store")
+        parser.add_argument("--ndjson",
+                            help="file name for newline-delimited JSON export",
+                            type=abspath,
+                            action="store")
+        parser.add_argument("-c", "--compact",
+                            help="write JSON export without indentation",
+                            action="store_true")
         parser.add_argument("-r", "--raw",
                             help="file name for raw log data export",
                             type=abspath,
                             action="store")
+        parser.add_argument("-s", "--since",
+                            help="only export waypoints logged at or after UTC time, e.g. 2019-07-09T12:00",
+                            type=parse_time,
+                            action="store")
+        parser.add_argument("-u", "--until",
+                            help="only export waypoints logged before UTC time",
+                            type=parse_time,
+                            action="store")
         parser.add_argument("-p", "--print",
                             help="print log content",
                             action="store_true")
         parser.add_argument("-e", "--erase",
                             help="erase GPS log data from device",
                             action="store_true")
+        parser.add_argument("-n", "--new",
+                            help="only print and export log sectors that changed since last read",
+                            action="store_true")
+        parser.add_argument("--no-cache",
+                            help="always read full log from device and don't update local log cache",
+                            action="store_true")
+
+    @staticmethod
+    def check_args(args) -> bool:
+        if args.since is not None and args.until is not None and args.since >= args.until:
+            logger.critical("Start of time range must be before its end")
+            return False
+        if args.segment_gap is not None and args.segment_gap < 1:
+            logger.critical("GPX segment gap must be at least one second")
+            return False
+        if args.new and args.no_cache:
+            logger.critical("Finding new log sectors requires the local log cache")
+            return False
+        return True
 
     def run(self):
 
@@ -65,123 +112,147 @@ class GpsLogCommand(CliCommand):
         elif stat['usage_percent'] >= 80:
             logger.warning("Log is almost full. Consider erasing soon")
 
-        if self.args.gpx or self.args.json or self.args.raw or self.args.print:
-            if stat["slots_used"] > 0 or self.args.raw:
+        log = None
+        raw_log_data = None
+        export = True
+        printed = False
+        if self.args.print or any(getattr(self.args, name) for name in LogSink.sinks):
+            cache = None if self.args.no_cache else open_cache(hx)
+            if cache is not None and cache.is_current(stat):
+                logger.info("GPS log unchanged since last read. Using cached log")
+                raw_log_data = cache.data
+                log = Locus() if self.args.new else parse_log(raw_log_data)
+            elif stat["slots_used"] > 0 or self.args.raw:
                 logger.info("Reading GPS log from handset")
-                raw_log_data = hx.gps.read_log(progress=True)
+                log, raw_log_data, printed = self.read_log(hx, cache)
                 logger.info(f"Received {len(raw_log_data)} bytes of raw log data from handset")
+                if cache is not None:
+                    cache.store(stat, raw_log_data)
             else:
                 logger.info("Nothing to read from handset")
-                raw_log_data = None
-        else:
-            raw_log_data = None
-
-        if self.args.print:
-            result = max(dump_log(raw_log_data), result)
-
-        if self.args.gpx:
-            logger.info("Exporting GPX log data to `%s`", self.args.gpx)
-            result = max(write_gpx(raw_log_data, self.args.gpx), result)
-
-        if self.args.json:
-            logger.info("Exporting JSON log data to `%s`", self.args.json)
-            result = max(write_json(raw_log_data, self.args.json), result)
-
-        if self.args.raw:
-            logger.info("Exporting raw log data to `%s`", self.args.raw)
-            result = max(write_raw(raw_log_data, self.args.raw), result)
+            if self.args.new:
+                if is_blank(log):
+                    logger.info("No new log sectors since last read. Nothing to export")
+                    export = False
+                else:
+                    logger.info(f"Exporting {len(log.sectors)} new log sectors")
+
+        if export and raw_log_data is not None:
+            sinks = []
+            for name, sink_class in LogSink.sinks.items():
+                file_name = getattr(self.args, name)
+                if not file_name:
+                    continue
+                if sink_class is GpxSink:
+                    if self.args.gpxpy:
+                        sinks.append(GpxpySink(file_name))
+                    else:
+                        sinks.append(GpxSink(file_name, segment_gap=self.args.segment_gap))
+                elif sink_class is JsonSink:
+                    sinks.append(JsonSink(file_name, compact=self.args.compact))
+                else:
+                    sinks.append(sink_class(file_name))
+            if self.args.print and not printed:
+                sinks.append(TextSink(None))
+            elif self.args.print and is_blank(log):
+                logger.info("Log is blank. Nothing to print")
+            if self.args.new:
+                raw_log_data = b"".join(sector.raw for sector in log.sectors)
+            result = max(export_log(LogData(log, raw_log_data, self.args.since, self.args.until), sinks), result)
 
         if self.args.erase:
             logger.info("Erasing GPS log data from device")
             hx.gps.erase_log()
+            if not self.args.no_cache:
+                cache = open_cache(hx)
+                if cache is not None:
+                    cache.clear()
 
         return result
 
-
-def write_gpx(log_data: bytes, file_name: str) -> int:
-    try:
-        log = Locus(log_data)
-    except LocusError:
-        logger.warning("Log is blank. Not writing empty GPX file")
-        return 0
-
-    gpx = gpxpy.gpx.GPX()
-
-    # Create first track in our GPX:
-    gpx_track = gpxpy.gpx.GPXTrack()
-    gpx.tracks.append(gpx_track)
-
-    # Create first segment in our GPX track:
-    gpx_segment = gpxpy.gpx.GPXTrackSegment()
-    gpx_track.segments.append(gpx_segment)
-
-    # Create points:
-    for point in log:
-        p = gpxpy.gpx.GPXTrackPoint(
-            time=datetime.datetime.utcfromtimestamp(point["utc_time"]),
-            latitude=point["latitude"],
-            longitude=point["longitude"],
-            elevation=point["height"]
-        )
-        # TODO: Use GPX 1.1 extensions for speed and heading, but which ones?
-        # {"nmea:speed": point["speed"] * 3.6 / 1.852}
-        # {"nmea:heading": point["heading"]}
-        gpx_segment.points.append(p)
-
-    with open(file_name, "w") as f:
-        f.write(gpx.to_xml(version="1.1"))
-
-    return 0
-
-
-def write_json(log_data: bytes, file_name: str) -> int:
+    def read_log(self, hx, cache: GpsLogCache or None = None) -> (Locus or None, bytes, bool):
+        """
+        Read GPS log from handset, parsing and printing every sector as soon as it is complete
+
+        With --new, sectors that are unchanged from the cached log are skipped without parsing.
+
+        :param hx: connected handset
+        :param cache: GpsLogCache of previous read or None
+        :return: (Locus or None if log can't be parsed, bytes raw log data, bool whether log was printed)
+        """
+        printed = self.args.print
+        log = Locus()
+        raw_log_data = bytearray()
+        for line_number, offset, sector_data in hx.gps.read_log_sectors(progress=True):
+            raw_log_data += sector_data
+            if log is None:
+                continue
+            if self.args.new and cache is not None and not cache.is_changed(offset, sector_data):
+                logger.debug(f"GPS log sector at 0x{offset:x} unchanged")
+                continue
+            try:
+                sector = log.append_sector(sector_data)
+            except LocusError as e:
+                logger.warning(f"Unable to parse GPS log sector at 0x{offset:x}: {e}")
+                log = None
+                continue
+            logger.debug(f"GPS log sector at 0x{offset:x} complete after line {line_number}, "
+                         f"{len(sector)} trackpoints")
+            if printed:
+                try:
+                    TextSink.write_waypoints(select_waypoints(sector.log, self.args.since, self.args.until))
+                except LocusError as e:
+                    logger.warning(f"Unable to print GPS log sector at 0x{offset:x}: {e}")
+                    printed = False
+        return log, bytes(raw_log_data), printed
+
+
+def open_cache(hx) -> GpsLogCache or None:
+    """
+    Open local log cache of handset, identified by flash ID and MMSI
+
+    Flash ID and MMSI are the same for all unprogrammed radios of a model,
+    so the USB identity is added whenever it's known.
+    """
     try:
-        log = Locus(log_data)
-    except LocusError:
-        logger.warning("Log is blank. Not writing empty JSON log")
-        return 0
-    jlog = {
-        "trackpoints": []
-    }
-    for wp in log:
-        new_wp = {}
-        for k in wp:
-            new_wp[k] = wp[k]
-        jlog["trackpoints"].append(new_wp)
-    with open(file_name, "w") as f:
-        dump(jlog, f, indent=4)
-    return 0
-
-
-def write_raw(log_data: bytes, file_name: str) -> int:
-    if log_data.startswith(b'\xff' * 16):
-        logger.info("Log is blank")
-    with open(file_name, "wb") as f:
-        f.write(log_data)
-    return 0
-
-
-def to_hm(deg: float) -> (int, float):
-    minutes, minutes_remainder = divmod(deg, 1/60)
-    hours, minutes = divmod(minutes, 60)
-    return int(hours), minutes + 60 * minutes_remainder
-
-
-def dump_log(log_data):
+        flash_id = hx.comm.get_flash_id()
+        mmsi, _ = hx.config.read_mmsi()
+    except (ProtocolError, TimeoutError) as e:
+        logger.warning(f"Unable to identify handset for GPS log cache: {e}")
+        return None
+    identity_key = getattr(hx, "identity_key", None)
+    if identity_key is None:
+        return GpsLogCache(cache_key(flash_id, mmsi))
+    return GpsLogCache(cache_key(flash_id, mmsi, identity_key))
+
+
+def parse_log(log_data: bytes) -> Locus or None:
     try:
-        log = Locus(log_data)
-    except LocusError:
-        logger.info("Log is blank. Nothing to print")
-        return 0
-    for wp in log:
-        lat_deg, lat_min = to_hm(wp['latitude'])
-        lat_dir = 'N' if lat_deg >= 0 else 'S'
-        lon_deg, lon_min = to_hm(wp['longitude'])
-        lon_dir = 'E' if lat_deg >= 0 else 'W'
-        print(f"{datetime.datetime.utcfromtimestamp(wp['utc_time']).isoformat()}\t"
-              f"{abs(lat_deg):02d}°{lat_min:07.04f}{lat_dir}\t"
-              f"{abs(lon_deg):03d}°{lon_min:07.04f}{lon_dir}\t"
-              f"{wp['height']:d}m\t"
-              f"{wp['heading']:3d}°\t"
-              f"{wp['speed']:2d}m/s\t")
-    return 0
+        return Locus(log_data)
+    except LocusError as e:
+        logger.warning(f"Unable to parse GPS log: {e}")
+        return None
+
+
+def is_blank(log: Locus or None) -> bool:
+    return log is None or len(log.sectors) == 0
+
+
+def parse_time(value: str) -> int:
+    """Parse UNIX timestamp or ISO 8601 UTC date and time into UNIX timestamp"""
+    if value.isdigit():
+        return int(value)
+    value = value.rstrip("Z").replace(" ", "T")
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return calendar.timegm(datetime.datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ArgumentTypeError(f"invalid UTC time `{value}`, expecting YYYY-MM-DD[THH:MM[:SS]]")
+
+
+def select_waypoints(log: Locus or LocusLog, since: int or None, until: int or None):
+    """Iterate all waypoints of log or only those within time range"""
+    if since is None and until is None:
+        return iter(log)
+    return log.between(since, until)
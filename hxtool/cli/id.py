@@ -13,6 +13,7 @@ class IdCommand(CliCommand):
 
     name = "id"
     help = "MMSI and ATIS setup"
+    batch = True
 
     @staticmethod
     def setup_args(parser) -> None:
@@ -41,37 +42,42 @@ class IdCommand(CliCommand):
             return 11
 
         if self.args.atis is None and self.args.mmsi is None and not self.args.reset:
+            hx.config.prefetch(hx.config.id_fields)
             mmsi, mmsi_status = hx.config.read_mmsi()
             atis, atis_status = hx.config.read_atis()
             print(f"MMSI: {mmsi} [{mmsi_status}]")
             print(f"ATIS: {atis} [{atis_status}]")
             return 0
 
-        if self.args.reset:
-            try:
-                logger.info("Resetting MMSI")
-                hx.config.write_mmsi()
-                logger.info("Resetting ATIS")
-                hx.config.write_atis()
-            except ProtocolError as e:
-                logger.error(e)
-                return 12
-
-        if self.args.atis is not None:
-            try:
-                logger.info(f"New ATIS `{self.args.atis}`")
-                hx.config.write_atis(self.args.atis)
-            except ProtocolError as e:
-                logger.error(e)
-                return 13
-
-        if self.args.mmsi is not None:
-            try:
-                logger.info(f"New MMSI `{self.args.mmsi}`")
-                hx.config.write_mmsi(self.args.mmsi)
-            except ProtocolError as e:
-                logger.error(e)
-                return 14
+        if not hx.verify_model():
+            logger.critical("Device doesn't match its cached model, run again to detect it")
+            return 10
+
+        # All changes go to the device in one coalesced write when the transaction ends
+        result = 15
+        try:
+            with hx.config.image.transaction():
+                if self.args.reset:
+                    result = 12
+                    logger.info("Resetting MMSI")
+                    hx.config.write_mmsi()
+                    logger.info("Resetting ATIS")
+                    hx.config.write_atis()
+
+                if self.args.atis is not None:
+                    result = 13
+                    logger.info(f"New ATIS `{self.args.atis}`")
+                    hx.config.write_atis(self.args.atis)
+
+                if self.args.mmsi is not None:
+                    result = 14
+                    logger.info(f"New MMSI `{self.args.mmsi}`")
+                    hx.config.write_mmsi(self.args.mmsi)
+
+                result = 15
+        except ProtocolError as e:
+            logger.error(e)
+            return result
 
         logger.info("Operation successful")
         return 0
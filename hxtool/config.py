@@ -1,41 +1,356 @@
 # -*- coding: utf-8 -*-
 
 from binascii import hexlify, unhexlify
+from contextlib import contextmanager
+from json import dumps, load
 from logging import getLogger
+from os import fsync, path, remove
 
+from .cache import write_atomically
 from .memory import unpack_waypoint
-from .protocol import GenericHXProtocol, ProtocolError
+from .protocol import GenericHXProtocol, ProtocolError, split_range
 
 logger = getLogger(__name__)
 
 
+def merge_ranges(ranges) -> list:
+    """Merge overlapping and adjacent (start, end) ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class ConfigImage(object):
+    """
+    Block-cached view of config memory
+
+    Blocks are read from the device on first access and served from memory
+    afterwards. Writes go to the cached image and are tracked as dirty ranges
+    until they are flushed, coalesced into as few transfer blocks as possible.
+    Block size probing only covers reads, so writes always use the default block size.
+    With autoflush, every write is flushed right away.
+    """
+
+    size = 0x8000
+    block_size = 0x40
+
+    def __init__(self, protocol: GenericHXProtocol, window=1, autoflush=True):
+        self.p = protocol
+        self.window = window
+        self.autoflush = autoflush
+        self.data = bytearray(self.size)
+        self.cached = set()  # indices of cached blocks
+        self.dirty = []  # (start, end) ranges not yet written to device
+
+    def __check_range(self, offset: int, length: int):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise ProtocolError(f"Config memory access at 0x{offset:04x} length 0x{length:02x} out of range")
+
+    def load(self, offset: int, length: int) -> None:
+        """Make sure range is cached"""
+        self.load_ranges([(offset, length)])
+
+    def load_ranges(self, ranges) -> None:
+        """Make sure all (offset, length) ranges are cached, reading all missing blocks in one planned pass"""
+        missing = set()
+        for offset, length in ranges:
+            self.__check_range(offset, length)
+            for index in range(offset // self.block_size, (offset + length - 1) // self.block_size + 1):
+                if length > 0 and index not in self.cached:
+                    missing.add(index)
+        if len(missing) == 0:
+            return
+        blocks = merge_ranges((index * self.block_size, (index + 1) * self.block_size) for index in missing)
+        blocks = [(start, end - start) for start, end in blocks]
+        for (start, _), data in zip(blocks, self.p.read_config_ranges(blocks, window=self.window)):
+            self.update(start, data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.load(offset, length)
+        return bytes(self.data[offset:offset + length])
+
+    def write(self, offset: int, data: bytes) -> None:
+        """Write to cached image, marking the range dirty if it changes anything"""
+        self.load(offset, len(data))
+        if self.data[offset:offset + len(data)] == data:
+            logger.debug("Skipping unchanged config write at 0x%04x", offset)
+            return
+        self.data[offset:offset + len(data)] = data
+        self.dirty.append((offset, offset + len(data)))
+        if self.autoflush:
+            self.flush()
+
+    def update(self, offset: int, data: bytes) -> None:
+        """Update cached image with data known to be in device memory"""
+        self.__check_range(offset, len(data))
+        self.data[offset:offset + len(data)] = data
+        first = -(-offset // self.block_size)  # only blocks fully covered by data become cached
+        for index in range(first, (offset + len(data)) // self.block_size):
+            self.cached.add(index)
+
+    def flush(self) -> int:
+        """
+        Write all dirty ranges to device
+
+        :return: int number of transfer blocks written
+        """
+        written = 0
+        for start, end in merge_ranges(self.dirty):
+            for offset, length in split_range(start, end, self.p.default_block_size):
+                self.write_block(offset, bytes(self.data[offset:offset + length]))
+                written += 1
+        self.dirty = []
+        return written
+
+    def discard(self) -> None:
+        """Drop unflushed writes, so affected blocks are read from device again"""
+        for start, end in self.dirty:
+            for index in range(start // self.block_size, (end - 1) // self.block_size + 1):
+                self.cached.discard(index)
+        self.dirty = []
+
+    @contextmanager
+    def transaction(self):
+        """Collect writes and flush them together, or drop them all on error"""
+        autoflush = self.autoflush
+        self.autoflush = False
+        try:
+            yield self
+        except BaseException:
+            self.discard()
+            raise
+        finally:
+            self.autoflush = autoflush
+        self.flush()
+
+    def write_block(self, offset: int, data: bytes) -> None:
+        """Write block to device, retrying according to the protocol's retry policy"""
+        self.p.retrying("write", self.p.write_config_memory, offset, data)
+        self.update(offset, data)
+
+
+class ConfigDump(object):
+    """
+    Config dump file that is written block by block as data arrives
+
+    A sidecar file next to the dump keeps a bitmap of completed blocks, so an
+    interrupted dump can be resumed by reading only the blocks still missing.
+    The sidecar is removed once the dump is complete.
+    """
+
+    size = 0x8000
+    block_size = 0x40
+    checkpoint_interval = 0x1000  # bytes received between sidecar updates
+
+    def __init__(self, file_name: str, flash_id: str or None = None):
+        self.file_name = file_name
+        self.flash_id = flash_id
+        self.done = bytearray(self.size // self.block_size // 8)
+        self.f = None
+        self.unsaved = 0
+
+    @property
+    def progress_file(self) -> str:
+        return self.file_name + ".progress"
+
+    def load(self) -> bool:
+        """Load progress of an earlier dump, returns False if there is nothing to resume"""
+        try:
+            with open(self.progress_file) as f:
+                meta = load(f)
+            done = unhexlify(meta["done"])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable dump progress `{self.progress_file}`: {e}")
+            return False
+        if meta.get("size") != self.size or meta.get("block_size") != self.block_size or len(done) != len(self.done):
+            logger.warning(f"Ignoring incompatible dump progress `{self.progress_file}`")
+            return False
+        if not path.isfile(self.file_name) or path.getsize(self.file_name) != self.size:
+            logger.warning(f"Ignoring dump progress for missing or truncated `{self.file_name}`")
+            return False
+        if self.flash_id is not None and meta.get("flash_id") != self.flash_id:
+            raise ProtocolError(f"Partial dump `{self.file_name}` is from a different handset "
+                                f"(flash ID {meta.get('flash_id')}, expected {self.flash_id})")
+        self.done[:] = done
+        return True
+
+    def save(self) -> None:
+        if self.f is not None:
+            # Data must hit the file before the sidecar claims it's there
+            self.f.flush()
+            fsync(self.f.fileno())
+        meta = {
+            "size": self.size,
+            "block_size": self.block_size,
+            "flash_id": self.flash_id,
+            "done": hexlify(self.done).decode("ascii")
+        }
+        write_atomically(self.progress_file, dumps(meta, indent=4).encode("utf-8"))
+        self.unsaved = 0
+
+    def is_done(self, index: int) -> bool:
+        return bool(self.done[index >> 3] & (1 << (index & 7)))
+
+    @property
+    def bytes_done(self) -> int:
+        return sum(bin(b).count("1") for b in self.done) * self.block_size
+
+    def missing(self) -> list:
+        """Merged (start, end) ranges not yet dumped"""
+        return merge_ranges((index * self.block_size, (index + 1) * self.block_size)
+                            for index in range(self.size // self.block_size) if not self.is_done(index))
+
+    def open(self, resume=False) -> None:
+        if resume:
+            self.f = open(self.file_name, "r+b")
+        else:
+            self.f = open(self.file_name, "wb")
+            self.f.truncate(self.size)
+            self.done[:] = bytes(len(self.done))
+            self.save()
+
+    def write(self, offset: int, data: bytes) -> None:
+        """Write block to dump file and mark it as done"""
+        self.f.seek(offset)
+        self.f.write(data)
+        first = -(-offset // self.block_size)  # only blocks fully covered by data are done
+        for index in range(first, (offset + len(data)) // self.block_size):
+            self.done[index >> 3] |= 1 << (index & 7)
+        self.unsaved += len(data)
+        if self.unsaved >= self.checkpoint_interval:
+            self.save()
+
+    def close(self) -> bool:
+        """Close dump file, returns True if the dump is complete"""
+        complete = len(self.missing()) == 0
+        if self.f is not None:
+            if complete:
+                self.f.close()
+                self.f = None
+                if path.exists(self.progress_file):
+                    remove(self.progress_file)
+            else:
+                self.save()
+                self.f.close()
+                self.f = None
+        return complete
+
+
 class GenericHXConfig(object):
 
+    # (offset, length) of fields read by the id and info commands
+    id_fields = ((0x00b0, 6), (0x00b6, 6))  # MMSI, ATIS
+    info_fields = id_fields + ((0x00a2, 1), (0x0100, 10), (0x010f, 1))  # ATIS enabled, flash ID, region
+
     def __init__(self, protocol: GenericHXProtocol):
         self.p = protocol
+        self.image = ConfigImage(protocol)
+
+    def prefetch(self, fields) -> None:
+        """Read all (offset, length) fields in one planned pass, so reading them later is free"""
+        self.image.load_ranges(fields)
 
-    def config_read(self, progress=False):
-        config_data = b''
-        bytes_to_go = 0x8000
-        for offset in range(0x0000, 0x8000, 0x40):
-            if progress:
-                percent_done = int(100.0 * offset / bytes_to_go)
-                if offset % 0x1000 == 0:
-                    logger.info(f"{offset} / {bytes_to_go} bytes ({percent_done}%)")
-            config_data += self.p.read_config_memory(offset, 0x40)
+    def config_read(self, progress=False, window=1):
+        config_data = bytearray(0x8000)
+        bytes_to_go = len(config_data)
+        bytes_done = 0
+        blocks = list(split_range(0x0000, 0x8000, self.p.transfer_block_size()))
+        if progress:
+            logger.info(f"0 / {bytes_to_go} bytes (0%)")
+        for offset, data in self.p.read_config_blocks(blocks, window=window):
+            config_data[offset:offset + len(data)] = data
+            bytes_done += len(data)
+            if progress and bytes_done % 0x1000 == 0 and bytes_done < bytes_to_go:
+                percent_done = int(100.0 * bytes_done / bytes_to_go)
+                logger.info(f"{bytes_done} / {bytes_to_go} bytes ({percent_done}%)")
         if progress:
             logger.info(f"{bytes_to_go} / {bytes_to_go} bytes (100%)")
-        return config_data
+        self.image.update(0x0000, config_data)
+        return bytes(config_data)
 
-    def config_write(self, data, check_region=True, progress=False):
+    def config_dump(self, file_name: str, resume=False, progress=False, window=1) -> bool:
+        """
+        Dump config memory to file, writing blocks as they arrive
+
+        Progress is checkpointed next to the file, so after a failure, resuming
+        only reads the blocks that are still missing.
+
+        :param file_name: str dump file
+        :param resume: bool continue an interrupted dump of the same handset
+        :param progress: bool log progress reports
+        :param window: int number of pipelined reads
+        :return: bool whether an earlier dump was resumed
+        """
+        dump = ConfigDump(file_name, flash_id=self.p.get_flash_id())
+        resumed = resume and dump.load()
+        if resume and not resumed:
+            logger.warning(f"No interrupted dump to resume at `{file_name}`, starting from scratch")
+        dump.open(resume=resumed)
+        bytes_to_go = dump.size
+        bytes_done = dump.bytes_done
+        if resumed:
+            logger.info(f"Resuming dump with {bytes_done} / {bytes_to_go} bytes already done")
+        blocks = [block for start, end in dump.missing()
+                  for block in split_range(start, end, self.p.transfer_block_size())]
+        if progress:
+            percent_done = int(100.0 * bytes_done / bytes_to_go)
+            logger.info(f"{bytes_done} / {bytes_to_go} bytes ({percent_done}%)")
+        try:
+            for offset, data in self.p.read_config_blocks(blocks, window=window):
+                dump.write(offset, data)
+                self.image.update(offset, data)
+                bytes_done += len(data)
+                if progress and bytes_done % 0x1000 == 0 and bytes_done < bytes_to_go:
+                    percent_done = int(100.0 * bytes_done / bytes_to_go)
+                    logger.info(f"{bytes_done} / {bytes_to_go} bytes ({percent_done}%)")
+        finally:
+            if not dump.close():
+                logger.info(f"Dump incomplete, {dump.bytes_done} / {bytes_to_go} bytes saved for --resume")
+        if progress:
+            logger.info(f"{bytes_to_go} / {bytes_to_go} bytes (100%)")
+        return resumed
+
+    def config_write(self, data, check_region=True, progress=False, diff=False, current=None, window=1) -> dict:
+        """
+        Write config image to device
+
+        In diff mode, only blocks that differ from the device's current config are written
+        and then verified by reading them back. The current config is read from the device
+        unless a known copy is passed in.
+
+        :param data: bytes config image
+        :param check_region: bool refuse to write config for a different region
+        :param progress: bool log progress reports
+        :param diff: bool only write changed blocks
+        :param current: bytes current config of device for diff mode, or None for reading it,
+                        only used for finding changed blocks
+        :param window: int number of pipelined reads
+        :return: dict number of blocks "written", "skipped" and "verified"
+        """
         bytes_to_go = len(data)
         if bytes_to_go != 0x8000:
             raise ProtocolError("Unexpected config data size")
-        magic = self.p.read_config_memory(0x0000, 2)
-        magic_end = self.p.read_config_memory(0x7ffe, 2)
+        if diff and current is None:
+            logger.info("Reading current config from device")
+            current = self.config_read(progress=progress, window=window)
+            magic = current[0x0000:0x0002]
+            magic_end = current[0x7ffe:0x8000]
+            region = current[0x010f:0x0110]
+        else:
+            # A known copy of the current config only saves reading it for the diff.
+            # Whether the image fits the handset is always checked against the handset itself.
+            magic, magic_end, region = self.p.read_config_ranges([(0x0000, 2), (0x7ffe, 2), (0x010f, 1)],
+                                                                 window=window)
+        if diff and len(current) != 0x8000:
+            raise ProtocolError("Unexpected current config data size")
         if magic != data[:2] or magic_end != data[-2:]:
             raise ProtocolError("Unexpected config magic in device")
-        region = self.p.read_config_memory(0x010f, 1)
         region_is_us = region == b'0xff'
         data_is_us = data[0x010f] == b'0xff'
         if region_is_us != data_is_us:
@@ -44,24 +359,51 @@ class GenericHXConfig(object):
                 raise ProtocolError("Region mismatch")
             logger.warning("Ignoring region mismatch. Flashing anyway")
 
+        # Magic bytes at 0x0000, 0x000f and 0x7ffe are never written
+        blocks = []
+        for start, end in ((0x0002, 0x000f), (0x0010, 0x7ffe)):
+            blocks.extend(split_range(start, end, self.p.default_block_size))
+        if diff:
+            changed = [(offset, length) for offset, length in blocks
+                       if data[offset:offset + length] != current[offset:offset + length]]
+        else:
+            changed = blocks
+        report = {
+            "written": len(changed),
+            "skipped": len(blocks) - len(changed),
+            "verified": 0
+        }
+
+        bytes_to_go = sum(length for _, length in changed)
+        bytes_done = 0
         if progress:
             logger.info(f"0 / {bytes_to_go} bytes (0%)")
-        self.p.write_config_memory(0x0002, data[0x0002:0x000f])
-        self.p.write_config_memory(0x0010, data[0x0010:0x0040])
-        for offset in range(0x0040, 0x7fc0, 0x40):
-            if progress:
-                percent_done = int(100.0 * offset / bytes_to_go)
-                if offset % 0x1000 == 0:
-                    logger.info(f"{offset} / {bytes_to_go} bytes ({percent_done}%)")
-            self.p.write_config_memory(offset, data[offset:offset+0x40])
-        self.p.write_config_memory(0x7fc0, data[0x7fc0:0x7ffe])
+        for offset, length in changed:
+            if progress and bytes_done // 0x1000 != (bytes_done + length) // 0x1000:
+                percent_done = int(100.0 * bytes_done / bytes_to_go)
+                logger.info(f"{bytes_done} / {bytes_to_go} bytes ({percent_done}%)")
+            self.write_block(offset, data[offset:offset + length])
+            bytes_done += length
         if progress:
             logger.info(f"{bytes_to_go} / {bytes_to_go} bytes (100%)")
 
+        if diff and len(changed) > 0:
+            mismatches = []
+            for offset, read_back in self.p.read_config_blocks(changed, window=window):
+                if read_back != data[offset:offset + len(read_back)]:
+                    mismatches.append(offset)
+            if len(mismatches) > 0:
+                addresses = ", ".join(f"0x{offset:04x}" for offset in sorted(mismatches))
+                raise ProtocolError(f"Verification failed for blocks at {addresses}")
+            report["verified"] = len(changed)
+
+        return report
+
+    def write_block(self, offset, data):
+        self.image.write_block(offset, data)
+
     def read_waypoints(self):
-        wp_data = b''
-        for address in range(0x4300, 0x5c00, 0x40):
-            wp_data += self.p.read_config_memory(address, 0x40)
+        wp_data = self.image.read(0x4300, 0x5c00 - 0x4300)
         wp_list = []
         for wp_id in range(1, 201):
             offset = (wp_id - 1) * 32
@@ -71,7 +413,7 @@ class GenericHXConfig(object):
         return wp_list
 
     def read_mmsi(self):
-        data = hexlify(self.p.read_config_memory(0x00b0, 6)).decode().upper()
+        data = hexlify(self.image.read(0x00b0, 6)).decode().upper()
         mmsi = data[0:9]
         status = data[10:12]
         return mmsi, status
@@ -93,10 +435,10 @@ class GenericHXConfig(object):
         if status.upper() not in ["00", "01", "02", "FF"]:
             raise ProtocolError("Invalid MMSI status")
         data = unhexlify(mmsi + status)
-        self.p.write_config_memory(0x00b0, data)
+        self.image.write(0x00b0, data)
 
     def read_atis(self):
-        data = hexlify(self.p.read_config_memory(0x00b6, 6)).decode().upper()
+        data = hexlify(self.image.read(0x00b6, 6)).decode().upper()
         atis = data[0:10]
         status = data[10:12]
         return atis, status
@@ -116,7 +458,13 @@ class GenericHXConfig(object):
         if status.upper() not in ["00", "01", "02", "FF"]:
             raise ProtocolError("Invalid ATIS status")
         data = unhexlify(atis + status)
-        self.p.write_config_memory(0x00b6, data)
+        self.image.write(0x00b6, data)
+
+    def read_region_code(self) -> int:
+        return self.image.read(0x010f, 1)[0]
+
+    def read_atis_enabled(self) -> int:
+        return self.image.read(0x00a2, 1)[0]
 
 
 class HX870Config(GenericHXConfig):
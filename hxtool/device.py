@@ -1,55 +1,62 @@
 # -*- coding: utf-8 -*-
 
+import builtins
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from logging import getLogger
 from serial.tools import list_ports
+from threading import Lock
+from time import time
 
+from .cache import DeviceIdentityCache
 from .config import HX870Config, HX890Config
 from .nmea import HX870NMEAProtocol, HX890NMEAProtocol
-from .protocol import GenericHXProtocol, MediaTekProtocol
+from .protocol import GenericHXProtocol, MediaTekProtocol, ProtocolError
 from .simulator import HXSimulator
 
 logger = getLogger(__name__)
 
+# Seconds a single port may take to identify itself before it's left behind
+probe_timeout = 10.0
+probe_max_workers = 16
 
-def enumerate(force_device=None, force_model=None, add_simulator=False):
+identity_cache = None  # DeviceIdentityCache, loaded on first use
 
-    global models
 
-    devices = []
+def enumerate(force_device=None, force_model=None, add_simulator=False, timeout=None):
 
-    if add_simulator:
-        sc = HXSimulator(mode="CP")
-        sc.start()
-        devices.append(HXSim(sc.tty))
-        sn = HXSimulator(mode="NMEA")
-        sn.start()
-        devices.append(HXSim(sn.tty))
+    global models
+
+    handles = list_devices(add_simulator=add_simulator)
 
     if force_device is None and force_model is None:
-        for model in models.values():
-            devices += enumerate_model(model)
-        return devices
+        return probe([(h.model, h.tty) for h in handles], timeout=timeout)
 
     elif force_device is not None and force_model is None:
 
         if force_device.isdecimal():
-            # User addressed device by its numeric selector
-            for model in models.values():
-                devices += enumerate_model(model)
+            # User addressed device by its numeric selector, so only that one is connected
             try:
-                return [devices[int(force_device)]]
+                handle = handles[int(force_device)]
             except IndexError:
                 logger.error(f"Invalid numeric device selector {force_device}")
                 return []
-
-        # Device is given as tty spec, so autodetect model
-        for m in [HX870, HX890]:
-            d = m(force_device)
-            if d.check_flash_id():
-                return [d]
-        else:
+            return [handle.connect()]
+
+        # Device is given as tty spec, so autodetect model unless it's known from earlier runs
+        port_info = find_port(force_device)
+        model = None
+        if is_identifiable(port_info):
+            model = models.get(get_identity_cache().get(DeviceIdentityCache.key(port_info)).get("model"))
+        if model is not None:
+            logger.debug(f"Device on {force_device} is known to be {model.handle}")
+            d = model(force_device, port_info=port_info)
+            d.model_verified = False  # verified before anything is written to it
+            return [d]
+        d = detect_model(force_device, port_info=port_info)
+        if d is None:
             logger.warning(f"Unable to detect model listening on {force_device}. Try specifying --model.")
             return []
+        return [d]
 
     elif force_device is not None and force_model is not None:
 
@@ -65,17 +72,188 @@ def enumerate(force_device=None, force_model=None, add_simulator=False):
     return []
 
 
-def enumerate_model(hx_device) -> list:
+def list_devices(add_simulator=False) -> list:
+    """
+    List radios from serial port metadata without talking to them
+
+    Indices into this list are the numeric device selectors.
+    """
+
+    handles = []
+
+    if add_simulator:
+        sc = HXSimulator(mode="CP")
+        sc.start()
+        handles.append(DeviceHandle(HXSim, sc.tty))
+        sn = HXSimulator(mode="NMEA")
+        sn.start()
+        handles.append(DeviceHandle(HXSim, sn.tty))
+
+    ports = list_ports.comports()
+    for model in models.values():
+        handles += model_handles(model, ports)
+
+    return handles
 
-    devices = []
 
+def detect_model(tty: str, port_info=None):
+    """
+    Detect model by the flash ID of the device on tty
+
+    The connection opened for reading the flash ID is handed on to the
+    matching device object, so detection costs a single connection and read.
+
+    :return: device object or None if no model matches
+    """
+    comm = GenericHXProtocol(tty=tty)
+    flash_id = None
+    if comm.cp_mode:
+        try:
+            flash_id = comm.get_flash_id()
+        except (ProtocolError, TimeoutError, UnicodeDecodeError) as e:
+            logger.debug(f"Unable to read flash ID on {tty}: {e}")
+    else:
+        logger.warning(f"Device on {tty} must be in CP mode to detect its model")
+    for m in models.values():
+        if flash_id in m.flash_id:
+            logger.debug(f"Flash ID {flash_id} on {tty} belongs to {m.handle}")
+            return m(tty, port_info=port_info, comm=comm)
+    if flash_id is not None:
+        logger.warning(f"Device on {tty} reported unknown flash ID {flash_id}")
+    comm.conn.close()
+    return None
+
+
+def get_identity_cache() -> DeviceIdentityCache:
+    global identity_cache
+    if identity_cache is None:
+        identity_cache = DeviceIdentityCache()
+    return identity_cache
+
+
+def find_port(tty: str):
+    """pyserial port info for a tty, if any"""
     for d in list_ports.comports():
+        if d.device == tty:
+            return d
+    return None
+
+
+def is_identifiable(port_info) -> bool:
+    """
+    Whether identity cache entries for a port can be trusted
+
+    Only a USB serial number tells radios apart. A port location alone is shared
+    by every radio that is ever plugged into the same slot.
+    """
+    return getattr(port_info, "serial_number", None) is not None
+
+
+def model_handles(hx_device, ports=None) -> list:
+    """Handles for serial ports with USB IDs matching device model"""
+
+    handles = []
+
+    for d in ports if ports is not None else list_ports.comports():
         if d.vid == hx_device.usb_vendor_id and d.pid == hx_device.usb_product_id:
             if not d.description == hx_device.usb_product_name \
                     and not d.description == f"{hx_device.usb_product_name} ({d.device})":
                 logger.warning(f"Unexpected serial device description `{d.description}` (BE CAREFUL)")
-            devices.append(hx_device(d.device))
+            handles.append(DeviceHandle(hx_device, d.device, d))
+
+    return handles
+
+
+class DeviceHandle(object):
+    """
+    Radio found on a serial port, but not connected to yet
+
+    Connecting opens the port and runs the handshake, so it's only done
+    for devices that are actually used.
+    """
+
+    def __init__(self, model, tty: str, port_info=None):
+        self.model = model
+        self.tty = tty
+        self.port_info = port_info
+
+    @property
+    def serial_number(self) -> str or None:
+        return getattr(self.port_info, "serial_number", None)
 
+    @property
+    def location(self) -> str or None:
+        return getattr(self.port_info, "location", None)
+
+    def connect(self):
+        return self.model(self.tty, port_info=self.port_info)
+
+    def __str__(self):
+        return f"{self.model.brand} {self.model.handle} on `{self.tty}`"
+
+
+def probe(candidates, timeout=None, max_workers=None) -> list:
+    """
+    Open devices on all candidate ports at once
+
+    Every port gets its own timeout budget, counted from when probing it starts.
+    Ports that fail or exceed their budget are skipped, so one unresponsive port
+    can't stall the others. Devices are returned in candidate order.
+
+    :param candidates: list of (device class, tty) tuples
+    :param timeout: float seconds per port, defaults to probe_timeout
+    :param max_workers: int maximum number of ports probed in parallel
+    :return: list of device objects
+    """
+    if len(candidates) == 0:
+        return []
+    timeout = probe_timeout if timeout is None else timeout
+    started = {}  # candidate index: time probing started
+    abandoned = set()
+    lock = Lock()
+
+    def open_device(index, model, tty):
+        started[index] = time()
+        return model(tty)
+
+    def close_late_device(index, future):
+        # Devices that show up after their budget ran out would otherwise keep their port open
+        with lock:
+            if index in abandoned and not future.cancelled() and future.exception() is None:
+                future.result().close()
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers or probe_max_workers, len(candidates)))
+    futures = {}
+    for index, (model, tty) in builtins.enumerate(candidates):
+        future = pool.submit(open_device, index, model, tty)
+        future.add_done_callback(lambda f, i=index: close_late_device(i, f))
+        futures[future] = index
+    pending = set(futures)
+    while pending:
+        now = time()
+        deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+        wait_time = max(0.0, min(deadlines) - now) if len(deadlines) == len(pending) else 0.1
+        _, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+        now = time()
+        for future in list(pending):
+            index = futures[future]
+            if index in started and now - started[index] >= timeout:
+                with lock:
+                    if future.done():
+                        continue  # made it just in time
+                    abandoned.add(index)
+                logger.warning(f"No answer from {candidates[index][1]} within {timeout:.1f}s, skipping it")
+                pending.remove(future)
+    pool.shutdown(wait=False)
+
+    devices = []
+    for future, index in futures.items():
+        if index in abandoned:
+            continue
+        try:
+            devices.append(future.result())
+        except (OSError, ProtocolError) as e:
+            logger.error(f"Unable to open {candidates[index][1]}: {e}")
     return devices
 
 
@@ -97,13 +275,28 @@ class HX870(object):
     nmea_model = HX870NMEAProtocol
     gps_model = MediaTekProtocol
 
-    def __init__(self, tty):
+    def __init__(self, tty, port_info=None, comm=None):
         self.tty = tty
-        self.comm = self.protocol_model(tty=tty)
+        self.port_info = port_info or find_port(tty)
+        # Key for per-radio caches, but only trusted for identity data with a USB serial number
+        self.identity_key = DeviceIdentityCache.key(self.port_info) if self.port_info is not None else None
+        self.identity = {}
+        if is_identifiable(self.port_info):
+            self.identity = get_identity_cache().get(self.identity_key)
+            if self.identity.get("model") != self.handle:
+                self.identity = {}  # cached for a different model, so nothing in it applies
+        # False if the model was only taken from the identity cache
+        self.model_verified = True
+        self.comm = comm or self.protocol_model(tty=tty)
+        if self.comm.block_size is None and self.identity.get("block_size") in self.comm.block_size_candidates:
+            # Verified by the radio rejecting transfers, which falls back to the default size
+            self.comm.block_size = self.identity["block_size"]
+        self.comm.block_size_listener = lambda block_size: self.remember()
         self.config = None
         self.nmea = None
         self.gps = None
         self.__init_config()
+        self.remember()
 
     def __init_config(self):
         # See what we're talking to on that tty
@@ -112,8 +305,14 @@ class HX870(object):
                 self.config = self.config_model(self.comm)
                 self.nmea = None
                 self.gps = self.gps_model(self.comm)
-                fw = self.comm.get_firmware_version()
-                logger.info(f"Device on {self.tty} is {self.handle} in CP mode, firmware version {fw}")
+                fw = self.identity.get("firmware_version")
+                if fw is None:
+                    fw = self.comm.get_firmware_version()
+                    logger.info(f"Device on {self.tty} is {self.handle} in CP mode, firmware version {fw}")
+                else:
+                    # Verified whenever the firmware version is actually queried
+                    self.comm.firmware_version = fw
+                    logger.info(f"Device on {self.tty} is {self.handle} in CP mode, firmware version {fw} (cached)")
             elif self.comm.nmea_mode:
                 self.config = None
                 self.nmea = self.nmea_model(self.comm)
@@ -134,12 +333,36 @@ class HX870(object):
         else:
             logger.error(f"Device on {self.tty} does not behave like HX hardware")
 
+    def close(self) -> None:
+        self.comm.conn.close()
+
     @property
     def cp_mode(self) -> bool:
         return self.comm.cp_mode
 
     def check_flash_id(self, flash_id: list or None = None):
-        return self.comm.check_flash_id(flash_id or self.flash_id)
+        result = self.comm.check_flash_id(flash_id or self.flash_id)
+        if is_identifiable(self.port_info):
+            if result:
+                self.remember()
+            else:
+                get_identity_cache().invalidate(self.identity_key)
+        return result
+
+    def verify_model(self) -> bool:
+        """Check the flash ID of a model taken from the identity cache, before writing to the radio"""
+        if not self.model_verified:
+            self.model_verified = self.check_flash_id()
+        return self.model_verified
+
+    def remember(self) -> None:
+        """Store what is known about the radio in the identity cache"""
+        if not is_identifiable(self.port_info) or not self.comm.hx_hardware:
+            return
+        mode = "CP" if self.comm.cp_mode else "NMEA" if self.comm.nmea_mode else None
+        get_identity_cache().update(self.identity_key, model=self.handle, flash_id=self.comm.flash_id,
+                                    firmware_version=self.comm.firmware_version, mode=mode,
+                                    block_size=self.comm.block_size)
 
     def __str__(self):
         return f"{self.brand} {self.handle} on `{self.tty} [{'CP Mode' if self.comm.cp_mode else 'NMEA Mode'}]`"
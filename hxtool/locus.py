@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from array import array
 from binascii import hexlify
+from bisect import bisect_left, bisect_right
 from enum import Enum, IntFlag
-from struct import pack, unpack, error as StructError
-from functools import reduce
+from struct import Struct, error as StructError
+from functools import lru_cache, reduce
+from itertools import accumulate
+from types import MappingProxyType
 
 
 class LocusError(Exception):
@@ -44,9 +48,27 @@ _LocusContentMap = {
 
 
 _SECTOR_SIZE = 0x1000
+_SECTOR_HEADER_SIZE = 0x40
+
+# array typecodes for struct format characters, making sure that
+# 4-byte integers get an array type that is large enough to hold them
+_ARRAY_TYPECODES = {
+    "I": "I" if array("I").itemsize >= 4 else "L",
+    "B": "B",
+    "f": "f",
+    "h": "h",
+    "H": "H"
+}
+
 
+@lru_cache(maxsize=None)
+def locus_content_descriptor(content: int) -> MappingProxyType:
+    """
+    Describe the record layout for a LogContent bitmap
 
-def locus_content_descriptor(content: int) -> dict:
+    Descriptors are built once per bitmap and shared by all parsers, so they are read-only.
+    "struct" unpacks a record's fields, "record_struct" additionally its checksum byte.
+    """
     content_size = 0
     fmt_str = "<"
     attributes = []
@@ -57,12 +79,58 @@ def locus_content_descriptor(content: int) -> dict:
             fmt_str += fmt
             attributes.append(desc.lower().replace(" ", "_"))
             labels.append(desc)
-    return {
+    return MappingProxyType({
         "size": content_size,
         "format": fmt_str,
-        "attributes": attributes,
-        "labels": labels
-    }
+        "attributes": tuple(attributes),
+        "labels": tuple(labels),
+        "struct": Struct(fmt_str),
+        "record_struct": Struct(fmt_str + "B")  # appending checksum byte
+    })
+
+
+def valid_records(data: bytes, record_size: int, *, verify=True) -> int:
+    """
+    Count the leading records in a sector's record area that hold waypoints
+
+    Records end at the first empty slot or, if verify is set, at the first one with
+    a bad checksum. Both checks run on all records at once using integer arithmetic
+    on the whole record area, instead of once per record in Python.
+    """
+    count = len(data) // record_size
+    if count == 0:
+        return 0
+    area = bytes(data[:count * record_size])
+    end = count
+
+    # Empty slots start with six 0xff or six 0x00 bytes
+    if record_size >= 6:
+        prefix_and = -1
+        prefix_or = 0
+        for i in range(6):
+            column = int.from_bytes(area[i::record_size], "little")
+            prefix_and &= column
+            prefix_or |= column
+        first_ff = prefix_and.to_bytes(count, "little").find(b"\xff")
+        first_zero = prefix_or.to_bytes(count, "little").find(b"\x00")
+        for first_empty in first_ff, first_zero:
+            if first_empty >= 0:
+                end = min(end, first_empty)
+
+    # XOR over a record including its checksum byte is zero for valid records.
+    # Shifting the whole area by one byte at a time sums up every record in its first byte.
+    if verify and end > 0:
+        area = area[:end * record_size]
+        records = int.from_bytes(area, "little")
+        sums = records
+        for i in range(1, record_size):
+            sums ^= records >> (8 * i)
+        first_bytes = int.from_bytes((b"\xff" + b"\x00" * (record_size - 1)) * end, "little")
+        sums = (sums & first_bytes).to_bytes(len(area), "little")[::record_size]
+        # Number of leading zero sums is the index of the first bad record
+        end = len(sums) - len(sums.lstrip(b"\x00"))
+
+    return end
 
 
 class LoggingMode(IntFlag):
@@ -86,6 +154,10 @@ class FixQuality(Enum):
     SIMULATOR = 8
 
 
+_HEADER_STRUCT = Struct("<HBBHHHHHBB")
+_HEADER_BODY_STRUCT = Struct("<HBBHHHHHB")  # without checksum byte
+
+
 class LocusHeader(object):
     def __init__(self, data: bytes, *, verify=True):
         if len(data) < 16:
@@ -101,21 +173,20 @@ class LocusHeader(object):
             self.SpeedSetting,
             self.unknown_0e,
             self.Checksum
-        ) = unpack("<HBBHHHHHBB", data[:16])
+        ) = _HEADER_STRUCT.unpack(data[:16])
         if verify and self.Checksum != checksum(data[:15]):
             raise LocusError(f"Invalid header checksum in {hexlify(data).decode('ascii')}")
 
     def __bytes__(self):
-        packed = pack("<HBBHHHHHB",
-                      self.SectorId,
-                      self.LoggingType,
-                      self.LoggingMode,
-                      self.LogContent,
-                      self.unknown_06,
-                      self.IntervalSetting,
-                      self.DistanceSetting,
-                      self.SpeedSetting,
-                      self.unknown_0e)
+        packed = _HEADER_BODY_STRUCT.pack(self.SectorId,
+                                          self.LoggingType,
+                                          self.LoggingMode,
+                                          self.LogContent,
+                                          self.unknown_06,
+                                          self.IntervalSetting,
+                                          self.DistanceSetting,
+                                          self.SpeedSetting,
+                                          self.unknown_0e)
         packed += bytes([checksum(packed)])
         return packed
 
@@ -125,30 +196,23 @@ class LocusWaypoint(object):
         if data.startswith(b"\xff"*6) or data.startswith(b"\x00"*6):
             raise LocusError("Empty waypoint data")
         content = locus_content_descriptor(content_byte)
-        self._size = content["size"]
-        self._format = content["format"]
-        self._attributes = content["attributes"]
-        self._labels = content["attributes"]
+        self._content = content
         self._d = {}
         if len(data) != content["size"] + 1:  # plus one checksum byte
             raise LocusError("Too much waypoint data")
         try:
-            parsed = unpack(content["format"] + "B", data)  # appending checksum byte
+            parsed = content["record_struct"].unpack(data)
         except StructError as e:
             raise LocusError(f"Waypoint data has unexpected format: {str(e)}") from e
         if len(parsed) != len(content["attributes"]) + 1:  # plus one checksum byte
             raise InternalError("Internal LOCUS parser error: parse size mismatch")
-        for i in range(len(content["attributes"])):
-            self._d[content["attributes"][i]] = parsed[i]
+        self._d = dict(zip(content["attributes"], parsed))
         self.checksum = parsed[-1]
         if verify and self.checksum != checksum(data[:-1]):
             raise LocusError(f"Checksum mismatch in waypoint data: {hexlify(data).decode('ascii')}")
 
     def __bytes__(self):
-        values = []
-        for attr in self._attributes:
-            values.append(self._d[attr])
-        packed = pack(self._format, values)
+        packed = self._content["struct"].pack(*(self._d[attr] for attr in self._content["attributes"]))
         packed += bytes([checksum(packed)])
         return packed
 
@@ -168,46 +232,110 @@ class LocusWaypoint(object):
 
 
 class LocusLog(object):
+    """
+    Waypoints in a sector's record area
+
+    Records are only counted up front. Waypoints are decoded from the underlying
+    buffer when they are accessed.
+    """
+
     def __init__(self, header: LocusHeader, data: bytes):
         self._header = header
-        content = locus_content_descriptor(header.LogContent)
-        self._waypoints = []
-        self._size = None
-        for offset in range(0, len(data), content["size"] + 1):  # plus checksum byte
-            start = offset
-            end = offset + content["size"] + 1  # plus checksum byte
-            if end > len(data):
-                break
-            try:
-                self._waypoints.append(LocusWaypoint(header.LogContent, data[start:end], verify=True))
-            except LocusError:
-                break
+        self._record_size = locus_content_descriptor(header.LogContent)["size"] + 1  # plus checksum byte
+        self._data = memoryview(data)
+        self._count = valid_records(self._data, self._record_size, verify=True)
+        self._utc_times = None
 
     def __len__(self):
-        return len(self._waypoints)
+        return self._count
 
     def __getitem__(self, item):
+        if type(item) is slice:
+            return [self.waypoint(index) for index in range(self._count)[item]]
         if type(item) is not int:
-            raise ValueError("log index must be int")
-        return self._waypoints[item]
+            raise ValueError("log index must be int or slice")
+        if item < 0:
+            item += self._count
+        if not 0 <= item < self._count:
+            raise IndexError("log index out of range")
+        return self.waypoint(item)
 
     def __iter__(self):
-        yield from self._waypoints
+        for index in range(self._count):
+            yield self.waypoint(index)
+
+    def waypoint(self, index: int) -> LocusWaypoint:
+        """Decode waypoint at non-negative index without range check"""
+        start = index * self._record_size
+        record = bytes(self._data[start:start + self._record_size])
+        return LocusWaypoint(self._header.LogContent, record, verify=False)  # counted records are verified
+
+    def records(self, start: int = 0, stop: int or None = None) -> memoryview:
+        """Raw record area holding this log's waypoints, or the ones from start to stop"""
+        stop = self._count if stop is None else min(stop, self._count)
+        return self._data[start * self._record_size:stop * self._record_size]
+
+    def utc_times(self) -> array:
+        """Timestamps of all waypoints, read from the record area without decoding waypoints"""
+        if self._utc_times is None:
+            if not self._header.LogContent & LocusContent.UTC:
+                raise LocusError("Log content has no UTC time")
+            utc_struct = Struct(f"<I{self._record_size - 4}x")  # UTC time is always the first field
+            self._utc_times = array(_ARRAY_TYPECODES["I"], (t for t, in utc_struct.iter_unpack(self.records())))
+        return self._utc_times
+
+    def time_range(self, start: int or None = None, end: int or None = None) -> range or list:
+        """
+        Indices of waypoints with start <= utc_time < end
+
+        Bisects if timestamps are in order, which is what the logger writes.
+
+        :param start: int UNIX timestamp or None for no lower bound
+        :param end: int UNIX timestamp or None for no upper bound
+        :return: range or list of waypoint indices
+        """
+        times = self.utc_times()
+        if all(a <= b for a, b in zip(times, times[1:])):
+            first = 0 if start is None else bisect_left(times, start)
+            stop = len(times) if end is None else bisect_left(times, end)
+            return range(first, max(first, stop))
+        return [index for index, t in enumerate(times)
+                if (start is None or t >= start) and (end is None or t < end)]
+
+    def between(self, start: int or None = None, end: int or None = None):
+        """Generator of waypoints with start <= utc_time < end"""
+        for index in self.time_range(start, end):
+            yield self.waypoint(index)
 
 
 class LocusSector(object):
+    """
+    A 4 kB LOCUS sector
+
+    The header is parsed right away, the waypoint log only on first access.
+    """
+
     def __init__(self, data: bytes, *, verify=True):
+        data = memoryview(data)
+        self.raw = data
         self.header = LocusHeader(data[:0x10], verify=verify)
-        self.mask = data[0x10:0x3c]
-        self.unknown_3c = data[0x3c:0x40]
-        self.log = LocusLog(self.header, data[0x40:])
+        self.mask = bytes(data[0x10:0x3c])
+        self.unknown_3c = bytes(data[0x3c:0x40])
+        self._data = data[_SECTOR_HEADER_SIZE:]
+        self._log = None
+
+    @property
+    def log(self) -> LocusLog:
+        if self._log is None:
+            self._log = LocusLog(self.header, self._data)
+        return self._log
 
     def __len__(self):
         return len(self.log)
 
     def __getitem__(self, item):
-        if type(item) is not int:
-            raise ValueError("log index must be int")
+        if type(item) not in (int, slice):
+            raise ValueError("log index must be int or slice")
         return self.log[item]
 
     def __iter__(self):
@@ -215,24 +343,235 @@ class LocusSector(object):
 
 
 class Locus(object):
-    def __init__(self, data: bytes, *, verify=True):
+    """
+    LOCUS log over raw log data
+
+    Sectors are views into the raw data, so nothing is copied. Only sector headers
+    are parsed on construction. Waypoints are counted on first indexed access, using a
+    prefix sum over sector lengths for bisecting the sector that holds a waypoint.
+    """
+
+    def __init__(self, data: bytes = b"", *, verify=True):
+        data = memoryview(data)
         self.sectors = []
+        self._offsets = None
+        self._time_index = None
         for sector_offset in range(0, len(data), _SECTOR_SIZE):
-            sector_data = data[sector_offset:sector_offset + _SECTOR_SIZE]
-            self.sectors.append(LocusSector(sector_data, verify=verify))
+            self.append_sector(data[sector_offset:sector_offset + _SECTOR_SIZE], verify=verify)
+
+    def append_sector(self, data: bytes, *, verify=True) -> LocusSector:
+        """
+        Add the next sector of a log that is still being read
+
+        :param data: bytes raw sector data
+        :param verify: bool verify sector header checksum
+        :return: LocusSector appended
+        """
+        sector = LocusSector(data, verify=verify)
+        self.sectors.append(sector)
+        if self._offsets is not None:
+            self._offsets.append(self._offsets[-1] + len(sector))
+        self._time_index = None
+        return sector
+
+    @property
+    def headers(self) -> list:
+        """Sector headers, without decoding any waypoints"""
+        return [sector.header for sector in self.sectors]
+
+    @property
+    def offsets(self) -> list:
+        """Index of every sector's first waypoint, plus total number of waypoints"""
+        if self._offsets is None:
+            self._offsets = [0] + list(accumulate(len(sector) for sector in self.sectors))
+        return self._offsets
+
+    def locate(self, item: int) -> (int, int):
+        """
+        Find waypoint by log index
+
+        :param item: int log index, negative indices count from the end
+        :return: (int, int) sector index and waypoint index within sector
+        """
+        offsets = self.offsets
+        if item < 0:
+            item += offsets[-1]
+        if not 0 <= item < offsets[-1]:
+            raise IndexError("log index out of range")
+        sector_index = bisect_right(offsets, item) - 1
+        return sector_index, item - offsets[sector_index]
 
     def __len__(self):
-        return sum(len(sector) for sector in self.sectors)
+        return self.offsets[-1]
 
     def __getitem__(self, item):
+        if type(item) is slice:
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return [self[index] for index in range(start, stop, step)]
+            return list(self.islice(start, stop))
         if type(item) is not int:
-            raise ValueError("log index must be int")
-        sector_index = 0
-        while sector_index < len(self.sectors) and item >= len(self.sectors[sector_index]):
-            item -= len(self.sectors[sector_index])
-            sector_index += 1
-        return self.sectors[sector_index][item]
+            raise ValueError("log index must be int or slice")
+        sector_index, index = self.locate(item)
+        return self.sectors[sector_index].log.waypoint(index)
 
     def __iter__(self):
         for sector in self.sectors:
             yield from sector
+
+    def islice(self, start: int, stop: int):
+        """Generator of waypoints from start to stop, decoding only sectors in range"""
+        offsets = self.offsets
+        start = max(0, start)
+        stop = min(stop, offsets[-1])
+        if start >= stop:
+            return
+        first = bisect_right(offsets, start) - 1
+        for sector_index in range(first, len(self.sectors)):
+            sector_start = offsets[sector_index]
+            if sector_start >= stop:
+                break
+            log = self.sectors[sector_index].log
+            for index in range(max(start - sector_start, 0), min(stop - sector_start, len(log))):
+                yield log.waypoint(index)
+
+    @property
+    def time_index(self) -> list:
+        """Per sector (min, max) utc_time, None for sectors without waypoints"""
+        if self._time_index is None:
+            self._time_index = []
+            for sector in self.sectors:
+                times = sector.log.utc_times()
+                self._time_index.append((min(times), max(times)) if len(times) > 0 else None)
+        return self._time_index
+
+    def time_sectors(self, start: int or None = None, end: int or None = None) -> list:
+        """Indices of sectors holding waypoints with start <= utc_time < end"""
+        return [sector_index for sector_index, bounds in enumerate(self.time_index)
+                if bounds is not None
+                and (start is None or bounds[1] >= start)
+                and (end is None or bounds[0] < end)]
+
+    def between(self, start: int or None = None, end: int or None = None):
+        """
+        Generator of waypoints with start <= utc_time < end
+
+        Decodes only waypoints in range of sectors that overlap with the time range.
+
+        :param start: int UNIX timestamp or None for no lower bound
+        :param end: int UNIX timestamp or None for no upper bound
+        """
+        for sector_index in self.time_sectors(start, end):
+            yield from self.sectors[sector_index].log.between(start, end)
+
+    def columns(self, start: int or None = None, end: int or None = None):
+        """
+        Columnar copy of waypoints, optionally only those with start <= utc_time < end
+
+        :param start: int UNIX timestamp or None for no lower bound
+        :param end: int UNIX timestamp or None for no upper bound
+        :return: LocusColumns or None if log holds no sectors
+        """
+        columns = None
+        for sector in self.sectors:
+            if columns is None:
+                columns = LocusColumns(sector.header.LogContent)
+            elif sector.header.LogContent != columns.content:
+                raise LocusError(f"Sector {sector.header.SectorId} has unexpected log content "
+                                 f"{sector.header.LogContent:#x}")
+        if start is None and end is None:
+            sector_indices = range(len(self.sectors))
+        else:
+            sector_indices = self.time_sectors(start, end)
+        for sector_index in sector_indices:
+            log = self.sectors[sector_index].log
+            if start is None and end is None:
+                indices = range(len(log))
+            else:
+                indices = log.time_range(start, end)
+            # counted records are verified
+            if type(indices) is range:
+                columns.append_records(log.records(indices.start, indices.stop), verify=False)
+            else:
+                for index in indices:
+                    columns.append_records(log.records(index, index + 1), verify=False)
+        return columns
+
+
+class LocusColumns(object):
+    """
+    Columnar LOCUS waypoint data
+
+    Holds one typed array per waypoint attribute instead of one object per waypoint.
+    """
+
+    def __init__(self, content: int):
+        descriptor = locus_content_descriptor(content)
+        self.content = content
+        self.attributes = list(descriptor["attributes"])
+        self.columns = {}
+        for attribute, fmt in zip(self.attributes, descriptor["format"][1:]):
+            self.columns[attribute] = array(_ARRAY_TYPECODES[fmt])
+
+    def __len__(self):
+        if len(self.attributes) == 0:
+            return 0
+        return len(self.columns[self.attributes[0]])
+
+    def __contains__(self, item):
+        return item in self.columns
+
+    def __getitem__(self, item):
+        return self.columns[item]
+
+    def __iter__(self):
+        yield from self.attributes
+
+    def append_records(self, data: bytes, *, verify=True) -> int:
+        """
+        Parse a sector's record area and append its waypoints
+
+        :param data: bytes record area following the sector header
+        :param verify: bool stop at first record with bad checksum
+        :return: int number of waypoints appended
+        """
+        descriptor = locus_content_descriptor(self.content)
+        record_size = descriptor["size"] + 1  # plus checksum byte
+        count = valid_records(data, record_size, verify=verify)
+        if count == 0:
+            return 0
+        records = descriptor["record_struct"].iter_unpack(bytes(data[:count * record_size]))
+        for attribute, values in zip(self.attributes, zip(*records)):
+            self.columns[attribute].extend(values)
+        return count
+
+    def extend(self, other):
+        if other.attributes != self.attributes:
+            raise LocusError("Unable to combine waypoints with different log content")
+        for attribute in self.attributes:
+            self.columns[attribute].extend(other.columns[attribute])
+
+    def rows(self):
+        """Generator of waypoint dicts"""
+        for values in zip(*(self.columns[attribute] for attribute in self.attributes)):
+            yield dict(zip(self.attributes, values))
+
+
+def parse_columns(data: bytes, *, verify=True) -> LocusColumns or None:
+    """
+    Parse a raw LOCUS log into columnar waypoint data in one pass
+
+    :param data: bytes raw log data
+    :param verify: bool verify sector header and waypoint checksums
+    :return: LocusColumns or None if log holds no sectors
+    """
+    columns = None
+    for sector_offset in range(0, len(data), _SECTOR_SIZE):
+        sector_data = data[sector_offset:sector_offset + _SECTOR_SIZE]
+        header = LocusHeader(sector_data[:_SECTOR_HEADER_SIZE], verify=verify)
+        if columns is None:
+            columns = LocusColumns(header.LogContent)
+        elif header.LogContent != columns.content:
+            raise LocusError(f"Sector at 0x{sector_offset:x} has unexpected log content {header.LogContent:#x}")
+        columns.append_records(sector_data[_SECTOR_HEADER_SIZE:], verify=verify)
+    return columns
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import datetime
+from itertools import islice, repeat
+from json import dumps
+from logging import getLogger
+from math import isfinite
+import sys
+from time import gmtime, strftime
+
+try:
+    import gpxpy.gpx
+except ImportError:
+    gpxpy = None
+
+from .locus import Locus, LocusError
+
+logger = getLogger(__name__)
+
+
+def to_hm(deg: float) -> (int, float):
+    minutes, minutes_remainder = divmod(deg, 1/60)
+    hours, minutes = divmod(minutes, 60)
+    return int(hours), minutes + 60 * minutes_remainder
+
+
+class LogData(object):
+    """
+    GPS log decoded once and shared by all export sinks
+
+    Waypoints are decoded into columns before any sink runs, so sinks running
+    concurrently only ever read from it. If decoding fails, the error is kept
+    and only sinks that don't need decoded waypoints can export the log.
+    """
+
+    def __init__(self, log: Locus or None, raw: bytes, since: int or None = None, until: int or None = None):
+        self.log = log
+        self.raw = raw
+        self.since = since
+        self.until = until
+        self.error = None
+        self.columns = None
+        if not self.is_blank():
+            try:
+                self.columns = log.columns(since, until)
+            except LocusError as e:
+                self.error = e
+
+    def is_blank(self) -> bool:
+        return self.log is None or len(self.log.sectors) == 0
+
+    def rows(self):
+        """Generator of waypoint dicts"""
+        if self.columns is not None:
+            yield from self.columns.rows()
+
+
+class LogSink(object):
+    """
+    Export target for GPS log data
+
+    Sinks are registered by their name, which is also the command line option
+    used for selecting them.
+    """
+
+    name = None
+    description = None
+    decoded = True  # whether the sink exports decoded waypoints
+    sinks = {}
+
+    @classmethod
+    def register(cls, sink_class):
+        cls.sinks[sink_class.name] = sink_class
+        return sink_class
+
+    def __init__(self, file_name: str or None):
+        self.file_name = file_name
+
+    def export(self, data: LogData) -> int:
+        """
+        Write log data
+
+        :param data: LogData to export
+        :return: int exit code, 0 on success
+        """
+        raise NotImplementedError()
+
+
+_GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="hxtool"
+  xmlns="http://www.topografix.com/GPX/1/1"
+  xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2"
+  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+  xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd
+    http://www.garmin.com/xmlschemas/TrackPointExtension/v2
+    https://www8.garmin.com/xmlschemas/TrackPointExtensionv2.xsd">
+  <trk>
+    <trkseg>
+"""
+_GPX_SEGMENT_BREAK = """    </trkseg>
+    <trkseg>
+"""
+_GPX_FOOTER = """    </trkseg>
+  </trk>
+</gpx>
+"""
+
+
+@LogSink.register
+class GpxSink(LogSink):
+    """
+    Streaming GPX 1.1 writer
+
+    Trackpoints are formatted straight from the log columns and written in chunks.
+    Speed and heading go into Garmin's TrackPointExtension, which most GPX tools
+    understand. A new track segment starts wherever the log has a time gap.
+    """
+
+    name = "gpx"
+    description = "GPX"
+    chunk_size = 1000  # trackpoints
+    segment_gap = 300  # seconds
+
+    def __init__(self, file_name: str or None, segment_gap: int or None = None):
+        super().__init__(file_name)
+        if segment_gap is not None:
+            self.segment_gap = segment_gap
+
+    def export(self, data: LogData) -> int:
+        if data.is_blank():
+            logger.warning("Log is blank. Not writing empty GPX file")
+            return 0
+        logger.info("Exporting GPX log data to `%s`", self.file_name)
+        with open(self.file_name, "w", encoding="utf-8") as f:
+            self.write(data.columns, f)
+        return 0
+
+    def write(self, columns, f) -> None:
+        """Write LocusColumns as GPX to file object f"""
+        f.write(_GPX_HEADER)
+        optional = [columns[attribute] if attribute in columns else repeat(None)
+                    for attribute in ("height", "speed", "heading")]
+        chunk = []
+        points = 0
+        last_time = None
+        for utc_time, lat, lon, height, speed, heading in zip(columns["utc_time"], columns["latitude"],
+                                                              columns["longitude"], *optional):
+            if last_time is not None and (utc_time - last_time > self.segment_gap or utc_time < last_time):
+                chunk.append(_GPX_SEGMENT_BREAK)
+            last_time = utc_time
+            chunk.append(f'      <trkpt lat="{lat:.7f}" lon="{lon:.7f}">\n')
+            if height is not None:
+                chunk.append(f"        <ele>{height}</ele>\n")
+            chunk.append(f"        <time>{strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(utc_time))}</time>\n")
+            if speed is not None or heading is not None:
+                chunk.append("        <extensions><gpxtpx:TrackPointExtension>")
+                if speed is not None:
+                    chunk.append(f"<gpxtpx:speed>{speed}</gpxtpx:speed>")
+                if heading is not None:
+                    chunk.append(f"<gpxtpx:course>{heading % 360}</gpxtpx:course>")
+                chunk.append("</gpxtpx:TrackPointExtension></extensions>\n")
+            chunk.append("      </trkpt>\n")
+            points += 1
+            if points % self.chunk_size == 0:
+                f.write("".join(chunk))
+                chunk.clear()
+        f.write("".join(chunk))
+        f.write(_GPX_FOOTER)
+
+
+class GpxpySink(LogSink):
+    """GPX export through gpxpy, without trackpoint extensions or segments"""
+
+    name = "gpx"
+    description = "GPX"
+
+    def export(self, data: LogData) -> int:
+        if gpxpy is None:
+            logger.error("GPX export through gpxpy requires the gpxpy package")
+            return 10
+        if data.is_blank():
+            logger.warning("Log is blank. Not writing empty GPX file")
+            return 0
+        logger.info("Exporting GPX log data to `%s` through gpxpy", self.file_name)
+
+        gpx = gpxpy.gpx.GPX()
+
+        # Create first track in our GPX:
+        gpx_track = gpxpy.gpx.GPXTrack()
+        gpx.tracks.append(gpx_track)
+
+        # Create first segment in our GPX track:
+        gpx_segment = gpxpy.gpx.GPXTrackSegment()
+        gpx_track.segments.append(gpx_segment)
+
+        # Create points:
+        for point in data.rows():
+            p = gpxpy.gpx.GPXTrackPoint(
+                time=datetime.datetime.utcfromtimestamp(point["utc_time"]),
+                latitude=point["latitude"],
+                longitude=point["longitude"],
+                elevation=point["height"]
+            )
+            gpx_segment.points.append(p)
+
+        with open(self.file_name, "w") as f:
+            f.write(gpx.to_xml(version="1.1"))
+
+        return 0
+
+
+def _json_record_template(attributes, compact: bool, indent: int = 8) -> str:
+    """%-format template for a JSON object holding one trackpoint"""
+    if compact:
+        return "{" + ",".join(f'"{attribute}":%r' for attribute in attributes) + "}"
+    inner = " " * (indent + 4)
+    return " " * indent + "{\n" + ",\n".join(f'{inner}"{attribute}": %r' for attribute in attributes) + \
+        "\n" + " " * indent + "}"
+
+
+def _json_records(columns, compact: bool, indent: int = 8):
+    """
+    Generator of trackpoints formatted as JSON objects
+
+    Formatting every record through one precompiled template is several times faster
+    than json.dumps, and yields the same output for finite numbers. Columns holding
+    NaN or infinity, which only the json module handles, fall back to json.dumps.
+    """
+    attributes = list(columns)
+    values = zip(*(columns[attribute] for attribute in attributes))
+    # Sums of float32 values are only non-finite if a value is
+    finite = all(isfinite(sum(columns[attribute])) for attribute in attributes if columns[attribute].typecode == "f")
+    if finite:
+        template = _json_record_template(attributes, compact, indent)
+        for record in values:
+            yield template % record
+    elif compact:
+        for record in values:
+            yield dumps(dict(zip(attributes, record)), separators=(",", ":"))
+    else:
+        for record in values:
+            lines = dumps(dict(zip(attributes, record)), indent=4).splitlines()
+            yield "\n".join(" " * indent + line for line in lines)
+
+
+@LogSink.register
+class JsonSink(LogSink):
+    """
+    Streaming JSON writer
+
+    Writes {"trackpoints": [...]} in chunks, either indented like json.dump(indent=4)
+    or compact without any whitespace.
+    """
+
+    name = "json"
+    description = "JSON"
+    chunk_size = 1000  # trackpoints
+
+    def __init__(self, file_name: str or None, compact: bool = False):
+        super().__init__(file_name)
+        self.compact = compact
+
+    def export(self, data: LogData) -> int:
+        if data.is_blank():
+            logger.warning("Log is blank. Not writing empty JSON log")
+            return 0
+        logger.info("Exporting JSON log data to `%s`", self.file_name)
+        with open(self.file_name, "w") as f:
+            self.write(data.columns, f)
+        return 0
+
+    def write(self, columns, f) -> None:
+        if self.compact:
+            head, separator, tail = '{"trackpoints":[', ",", "]}"
+        else:
+            head, separator, tail = '{\n    "trackpoints": [\n', ",\n", "\n    ]\n}"
+        if len(columns) == 0:
+            f.write(head.rstrip() + tail.lstrip())
+            return
+        f.write(head)
+        records = _json_records(columns, self.compact)
+        chunk = list(islice(records, self.chunk_size))
+        while len(chunk) > 0:
+            f.write(separator.join(chunk))
+            chunk = list(islice(records, self.chunk_size))
+            if len(chunk) > 0:
+                f.write(separator)
+        f.write(tail)
+
+
+@LogSink.register
+class NdjsonSink(LogSink):
+    """Newline-delimited JSON writer with one compact trackpoint object per line"""
+
+    name = "ndjson"
+    description = "NDJSON"
+    chunk_size = 1000  # trackpoints
+
+    def export(self, data: LogData) -> int:
+        if data.is_blank():
+            logger.warning("Log is blank. Not writing empty NDJSON log")
+            return 0
+        logger.info("Exporting NDJSON log data to `%s`", self.file_name)
+        with open(self.file_name, "w") as f:
+            self.write(data.columns, f)
+        return 0
+
+    def write(self, columns, f) -> None:
+        records = _json_records(columns, compact=True)
+        chunk = list(islice(records, self.chunk_size))
+        while len(chunk) > 0:
+            f.write("\n".join(chunk) + "\n")
+            chunk = list(islice(records, self.chunk_size))
+
+
+@LogSink.register
+class RawSink(LogSink):
+
+    name = "raw"
+    description = "raw"
+    decoded = False
+
+    def export(self, data: LogData) -> int:
+        logger.info("Exporting raw log data to `%s`", self.file_name)
+        log_data = data.raw
+        if log_data.startswith(b'\xff' * 16):
+            logger.info("Log is blank")
+        elif data.since is not None or data.until is not None:
+            # Raw export can only be filtered by whole sectors
+            sector_indices = None
+            if data.log is not None:
+                try:
+                    sector_indices = data.log.time_sectors(data.since, data.until)
+                except LocusError as e:
+                    logger.debug(f"Unable to find log sectors by time: {e}")
+            if sector_indices is None:
+                logger.warning("Unable to parse log times. Writing unfiltered raw log data")
+            else:
+                log_data = b"".join(data.log.sectors[index].raw for index in sector_indices)
+        with open(self.file_name, "wb") as f:
+            f.write(log_data)
+        return 0
+
+
+class TextSink(LogSink):
+    """Human-readable trackpoint listing, printed to stdout unless a file name is given"""
+
+    name = "print"
+    description = "text"
+
+    def export(self, data: LogData) -> int:
+        if data.is_blank():
+            logger.info("Log is blank. Nothing to print")
+            return 0
+        if self.file_name is None:
+            self.write_waypoints(data.rows())
+        else:
+            with open(self.file_name, "w") as f:
+                self.write_waypoints(data.rows(), f)
+        return 0
+
+    @staticmethod
+    def write_waypoints(waypoints, f=None) -> None:
+        f = f or sys.stdout
+        for wp in waypoints:
+            lat_deg, lat_min = to_hm(wp['latitude'])
+            lat_dir = 'N' if lat_deg >= 0 else 'S'
+            lon_deg, lon_min = to_hm(wp['longitude'])
+            lon_dir = 'E' if lat_deg >= 0 else 'W'
+            print(f"{datetime.datetime.utcfromtimestamp(wp['utc_time']).isoformat()}\t"
+                  f"{abs(lat_deg):02d}°{lat_min:07.04f}{lat_dir}\t"
+                  f"{abs(lon_deg):03d}°{lon_min:07.04f}{lon_dir}\t"
+                  f"{wp['height']:d}m\t"
+                  f"{wp['heading']:3d}°\t"
+                  f"{wp['speed']:2d}m/s\t", file=f)
+
+
+def export(data: LogData, sinks: list, max_workers: int = 4) -> int:
+    """
+    Run export sinks on a thread pool, so their file writes overlap
+
+    :param data: LogData shared by all sinks
+    :param sinks: list of LogSink
+    :param max_workers: int maximum number of sinks running at once
+    :return: int highest exit code returned by any sink
+    """
+    result = 0
+    if data.error is not None:
+        for sink in sinks:
+            if sink.decoded:
+                logger.error(f"Unable to decode GPS log for {sink.description} export: {data.error}")
+                result = 10
+        sinks = [sink for sink in sinks if not sink.decoded]
+    if len(sinks) == 0:
+        return result
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sinks))) as pool:
+        # Sinks run in the caller's context, so output captured for the caller covers them
+        futures = [pool.submit(copy_context().run, sink.export, data) for sink in sinks]
+        for sink, future in zip(sinks, futures):
+            try:
+                result = max(future.result(), result)
+            except OSError as e:
+                logger.error(f"Unable to write {sink.description} export `{sink.file_name}`: {e}")
+                result = max(result, 10)
+    return result
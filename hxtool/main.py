@@ -43,6 +43,11 @@ def get_args(args=None):
                         choices=["HX870", "HX890"],
                         action="store")
 
+    parser.add_argument("--all",
+                        help="run command on all detected devices in parallel and print a JSON summary, "
+                             "`{device}` in file names is replaced by the device number",
+                        action="store_true")
+
     parser.add_argument("--simulator",
                         help="enable simulator devices",
                         action="store_true")
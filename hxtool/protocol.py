@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from binascii import hexlify, unhexlify
-from functools import reduce
+from bisect import bisect_right
+from collections import Counter, deque
 from logging import getLogger
 from time import time, sleep
 from typing import List
@@ -15,120 +16,357 @@ class ProtocolError(Exception):
     pass
 
 
+def xor_checksum(data: bytes) -> int:
+    """
+    XOR over all bytes of data
+
+    Instead of looping over single bytes, the data is treated as one big
+    integer that is repeatedly folded in half, which runs in C.
+    """
+    size = len(data)
+    if size == 0:
+        return 0
+    folded = int.from_bytes(data, "little")
+    while size > 1:
+        half = (size + 1) // 2
+        folded = (folded & ((1 << (8 * half)) - 1)) ^ (folded >> (8 * half))
+        size = half
+    return folded
+
+
+_UNSET = object()
+
+
+def split_range(start: int, end: int, block_size: int):
+    """Split a config memory range into block-aligned (offset, length) transfer blocks"""
+    offset = start
+    while offset < end:
+        length = min(block_size - offset % block_size, end - offset)
+        yield offset, length
+        offset += length
+
+
+def plan_config_reads(ranges, block_size: int) -> list:
+    """
+    Plan the fewest block-aligned config memory reads covering all (offset, length) ranges
+
+    Overlapping and neighbouring ranges are merged per aligned block, and every read
+    only spans the bytes that are needed from its block.
+
+    :param ranges: iterable of (offset, length) tuples
+    :param block_size: int largest transfer block size of the link
+    :return: list of (offset, length) reads, sorted by offset
+    """
+    spans = {}
+    for offset, length in ranges:
+        for block_offset, block_length in split_range(offset, offset + length, block_size):
+            index = block_offset // block_size
+            start, end = spans.get(index, (block_offset, block_offset + block_length))
+            spans[index] = (min(start, block_offset), max(end, block_offset + block_length))
+    return [(start, end - start) for _, (start, end) in sorted(spans.items())]
+
+
 class Message(object):
     """
     Generic HX Message Object
+
+    Messages are meant to be immutable after construction. Their wire encoding and
+    checksum are cached, and replacing type, args or received checksum resets the cache.
     """
 
-    UNARY_TYPES = ["#CMDOK", "#CMDER", "#CMDUN", "#CMDSM", "#CMDSY"]  # no args and no checksum
+    __slots__ = ("_type", "_args", "_checksum_recv", "_body", "_checksum", "_wire")
+
+    UNARY_TYPES = frozenset(["#CMDOK", "#CMDER", "#CMDUN", "#CMDSM", "#CMDSY"])  # no args and no checksum
 
     def __init__(self, message_type: str = None, args: List[str] = None, parse: bytes or str = None):
 
-        self.type = message_type
-        self.args = args or []
-        self.checksum_recv = None
+        self._type = message_type
+        self._args = args or []
+        self._checksum_recv = None
+        self._body = None  # raw bytes covered by checksum
+        self._checksum = _UNSET
+        self._wire = None
 
         if parse is not None:
-            if type(parse) is bytes:
-                parse = parse.decode("ascii")
-            if parse.startswith("#"):
-                # CP mode command message
-                parsed = parse.rstrip("\r\n").split("\t")
-                self.type = parsed[0]
-                if len(parsed) > 1:
-                    self.checksum_recv = parsed[-1]
-                if len(parsed) > 2:
-                    self.args = parsed[1:-1]
-            elif parse.startswith("$"):
-                # NMEA sentence
-                parsed = parse.rstrip("\r\n")
-                self.type = parsed[:5]
-                args, self.checksum_recv = parsed[5:].split("*")
-                self.args = args.split(",")
-            else:
-                raise ProtocolError(f"Invalid message `{parse}`")
+            if type(parse) is str:
+                parse = parse.encode("ascii")
+            self.__parse(parse)
+
+    def __parse(self, frame: bytes):
+        line = frame.rstrip(b"\r\n")
+        if line.startswith(b"#"):
+            # CP mode command message
+            parsed = line.split(b"\t")
+            self._type = parsed[0].decode("ascii")
+            if len(parsed) > 1:
+                self._checksum_recv = parsed[-1].decode("ascii")
+                self._body = line[:len(line) - len(parsed[-1])]
+                if self._type not in self.UNARY_TYPES:
+                    self._wire = line + b"\r\n"
+            if len(parsed) > 2:
+                self._args = [arg.decode("ascii") for arg in parsed[1:-1]]
+        elif line.startswith(b"$"):
+            # NMEA sentence
+            self._type = line[:5].decode("ascii")
+            args, star, checksum_recv = line[5:].partition(b"*")
+            self._args = args.decode("ascii").split(",")
+            self._body = line[1:5 + len(args)]
+            if star:
+                self._checksum_recv = checksum_recv.decode("ascii")
+                self._wire = line + b"\r\n"
+        else:
+            raise ProtocolError(f"Invalid message `{frame.decode('ascii', 'replace')}`")
+
+    def __reset(self):
+        self._body = None
+        self._checksum = _UNSET
+        self._wire = None
+
+    @property
+    def type(self):
+        return self._type
+
+    @type.setter
+    def type(self, value):
+        self._type = value
+        self.__reset()
+
+    @property
+    def args(self):
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        self._args = value
+        self.__reset()
+
+    @property
+    def checksum_recv(self):
+        return self._checksum_recv
+
+    @checksum_recv.setter
+    def checksum_recv(self, value):
+        self._checksum_recv = value
+        self._wire = None
 
     def validate(self, checksum=None):
         if checksum is None:
             checksum = self.checksum
-        if self.checksum_recv is None:
+        if self._checksum_recv is None:
             return True
-        return checksum == self.checksum_recv
+        return checksum == self._checksum_recv
 
     @property
     def checksum(self):
-        if self.type in self.UNARY_TYPES:
-            return None
-        elif self.type.startswith("#"):
-            check = ("\t".join([self.type] + self.args) + "\t").encode("ascii")
-            return "%02X" % reduce(lambda x, y: x ^ y, filter(lambda x: x != "!", check))
-        elif self.type.startswith("$"):
-            check = (self.type[1:] + ",".join(self.args)).encode("ascii")
-            return "%02X" % reduce(lambda x, y: x ^ y, filter(lambda x: x != "!", check))
-        else:
-            return None
-
-    def __str_no_check(self):
-        if self.type.startswith("#"):
-            return "\t".join([self.type] + self.args)
-        elif self.type.startswith("$"):
-            return self.type + ",".join(self.args)
-        else:
-            raise ProtocolError(f"Invalid message type `{self.type}`")
-
-    def __str__(self):
-        if self.type.startswith("#"):
-            if self.type in self.UNARY_TYPES:
-                msg = [self.type]
+        if self._checksum is _UNSET:
+            if self._type in self.UNARY_TYPES:
+                self._checksum = None
+            elif self._type.startswith("#"):
+                if self._body is None:
+                    self._body = ("\t".join([self._type] + self._args) + "\t").encode("ascii")
+                self._checksum = "%02X" % xor_checksum(self._body)
+            elif self._type.startswith("$"):
+                if self._body is None:
+                    self._body = (self._type[1:] + ",".join(self._args)).encode("ascii")
+                self._checksum = "%02X" % xor_checksum(self._body)
             else:
-                # Received checksum has precedence over calculated
-                check = self.checksum_recv or self.checksum
-                msg = [self.type] + self.args + [check]
-            return "\t".join(msg) + "\r\n"
-        elif self.type.startswith("$"):
-            # Received checksum has precedence over calculated
-            check = self.checksum_recv or self.checksum
-            return (self.type + ",".join(self.args) + "*" + check) + "\r\n"
+                self._checksum = None
+        return self._checksum
 
     def __bytes__(self):
-        return str(self).encode("ascii")
+        if self._wire is None:
+            if self._type.startswith("#"):
+                if self._type in self.UNARY_TYPES:
+                    msg = [self._type]
+                else:
+                    # Received checksum has precedence over calculated
+                    msg = [self._type] + self._args + [self._checksum_recv or self.checksum]
+                self._wire = ("\t".join(msg) + "\r\n").encode("ascii")
+            elif self._type.startswith("$"):
+                # Received checksum has precedence over calculated
+                check = self._checksum_recv or self.checksum
+                self._wire = (self._type + ",".join(self._args) + "*" + check + "\r\n").encode("ascii")
+            else:
+                raise ProtocolError(f"Invalid message type `{self._type}`")
+        return self._wire
+
+    def __str__(self):
+        return bytes(self).decode("ascii")
 
     def __repr__(self):
         return repr(bytes(self))
 
     def __iter__(self):
-        for b in bytes(self):
-            yield b
+        yield from bytes(self)
 
     def __eq__(self, other):
-        if str(self) != str(other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        if bytes(self) != bytes(other):
             return False
         else:
-            if self.checksum_recv == other.checksum_recv:
+            if self._checksum_recv == other._checksum_recv:
                 return True
             else:
-                if self.checksum_recv is None or other.checksum_recv is None:
+                if self._checksum_recv is None or other._checksum_recv is None:
                     return True
                 else:
                     return False
 
     @classmethod
     def parse(cls, messages):
-        if type(messages) is bytes:
-            messages = messages.decode('ascii')
-        for message in messages.split("\r\n"):
+        if type(messages) is str:
+            messages = messages.encode("ascii")
+        for message in messages.split(b"\r\n"):
             if len(message) > 0:
                 yield cls(parse=message)
 
 
+class MessageDecoder(object):
+    """
+    Incremental decoder for #CMD messages and NMEA sentences
+
+    Input can be fed in chunks of any size. Partial messages are kept until
+    the rest arrives. Bytes outside of messages, like the "P" and "@" replies
+    to mode detection, are passed on as single-byte bytes objects.
+    """
+
+    FRAME_START = b"#$"
+    MAX_FRAME_LENGTH = 1024
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = 0
+
+    def reset(self):
+        self.buffer.clear()
+        self.start = 0
+
+    def pending(self) -> int:
+        return len(self.buffer) - self.start
+
+    def feed(self, data: bytes):
+        """
+        Add input and decode everything that is complete
+
+        :param data: bytes received
+        :return: generator of Message objects and stray bytes
+        """
+        if self.start > 0:
+            del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+        return self.decode()
+
+    def decode(self):
+        """
+        Decode buffered input
+
+        Decoding state is kept in the decoder, so when a malformed message raises
+        ProtocolError, calling decode() again continues right after it.
+        """
+        buffer = self.buffer
+        while self.start < len(buffer):
+            start = self.start
+            if buffer[start] not in self.FRAME_START:
+                self.start += 1
+                yield bytes(buffer[start:start + 1])
+                continue
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                if len(buffer) - start > self.MAX_FRAME_LENGTH:
+                    # Runaway frame, so treat its first byte as noise and resync
+                    self.start += 1
+                    yield bytes(buffer[start:start + 1])
+                    continue
+                return
+            self.start = end + 1
+            frame = bytes(buffer[start:end + 1])
+            try:
+                yield Message(parse=frame)
+            except (UnicodeDecodeError, ValueError) as e:
+                raise ProtocolError(f"Invalid message {frame}") from e
+
+
+class RetryPolicy(object):
+    """
+    Retry policy for single block transfers
+
+    A failed transfer is retried after an exponentially growing delay, resyncing
+    the connection in between, so one garbled frame doesn't abort a bulk transfer.
+    """
+
+    def __init__(self, attempts=3, delay=0.05, max_delay=1.0, backoff=2.0):
+        if attempts < 1:
+            raise ValueError("Retry policy needs at least one attempt")
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Delay before re-issuing a transfer that failed `attempt` times"""
+        return min(self.delay * self.backoff ** (attempt - 1), self.max_delay)
+
+    def call(self, protocol, operation: str, function, *args):
+        """
+        Call function until it succeeds or attempts are exhausted
+
+        :param protocol: GenericHXProtocol to resync and count statistics on
+        :param operation: str operation name for statistics, like "read" or "write"
+        :param function: callable single block transfer
+        :return: whatever function returns
+        """
+        attempt = 1
+        while True:
+            try:
+                return function(*args)
+            except (ProtocolError, TimeoutError) as e:
+                if attempt >= self.attempts:
+                    protocol.stats[f"{operation}_failures"] += 1
+                    raise
+                protocol.stats[f"{operation}_retries"] += 1
+                logger.debug(f"Retrying {operation} after attempt {attempt} failed: {e}")
+                sleep(self.backoff_delay(attempt))
+                attempt += 1
+                protocol.ready = False
+                try:
+                    protocol.sync()
+                except (ProtocolError, TimeoutError) as sync_error:
+                    logger.debug(f"Sync before retry failed: {sync_error}")
+
+
 class GenericHXProtocol(object):
 
+    # Backoff for #CEPSR status polls while the radio reports busy
+    ready_poll_delay = 0.005
+    ready_poll_max_delay = 0.2
+
+    # Block sizes for bulk #CEPRD/#CEPWR transfers. The LENGTH field is a single hex byte,
+    # so 0x80 is the largest size that evenly divides config memory. 0x40 is what the
+    # official software uses and what all radios are known to accept.
+    default_block_size = 0x40
+    block_size_candidates = (0x80, 0x40)
+    block_size_cache = {}  # (flash ID, firmware version): block size
+    flash_id_range = (0x0100, 10)  # offset and length in config memory
+    retry_policy = RetryPolicy()
+
     def __init__(self, tty=None):
         self.conn = None
         self.connected = False
         self.hx_hardware = False
         self.cp_mode = False
         self.nmea_mode = False
+        # The radio only becomes busy after config writes, so its ready state is
+        # tracked to avoid polling its status before every single command.
+        self.ready = False
+        self.stats = Counter()
+        self.firmware_version = None
+        self.flash_id = None
+        self.block_size = None
+        # Called with the block size whenever it's probed or reduced, for persisting it
+        self.block_size_listener = None
+        self.decoder = MessageDecoder()
         self.__connect(tty)
 
     def __connect(self, tty):
@@ -155,7 +393,7 @@ class GenericHXProtocol(object):
         #   - "P" if it is in NMEA mode, and
         #   - "?" if it is in CP mode
 
-        self.conn.flush_input()
+        self.flush_input()
         self.conn.flush_output()
 
         self.conn.write(b"P?")
@@ -173,7 +411,7 @@ class GenericHXProtocol(object):
             # a NMEA message before it replies with "P", so flush.
             if r == b"$":
                 logger.debug("Probable race condition with NMEA message detected, assuming NMEA mode")
-                self.conn.flush_input()
+                self.flush_input()
             logger.debug("Response like HX hardware in NMEA mode")
             self.hx_hardware = True
             self.nmea_mode = True
@@ -203,15 +441,19 @@ class GenericHXProtocol(object):
     def read_line(self, *args, **kwargs):
         return self.conn.read_line(*args, **kwargs)
 
+    def flush_input(self):
+        self.decoder.reset()
+        return self.conn.flush_input()
+
     def send(self, message_type, args=None):
-        self.write(Message(message_type, args))
+        self.write(bytes(Message(message_type, args)))
 
     def receive(self, ignore_full_stop=True, ignore_text_messages=True, ignore_system_messages=True):
         # GPS module starts sputtering "FULL_STOP" log messages in comms when log is full.
         # Some firmware versions seem to restart the GPS module at unexpected moments, resulting
         # in spurious system and text messages. These are also ignored per default.
         while True:
-            m = Message(parse=self.read_line())
+            m = self.__next_message()
             if ignore_full_stop and m.type == "$PMTK" and m.args == ["LOG", "FULL_STOP"]:
                 logger.debug(f"Ignoring GPS module FULL_STOP warning {str(m).strip()}")
                 continue
@@ -223,6 +465,14 @@ class GenericHXProtocol(object):
                 continue
             return m
 
+    def __next_message(self):
+        while True:
+            for item in self.decoder.decode():
+                if isinstance(item, Message):
+                    return item
+                logger.debug(f"Ignoring stray input {item}")
+            self.decoder.feed(self.read_line())
+
     def cmd_mode(self):
         logger.debug("Sending command mode request")
         # The HX870 doesn't seem to care. It responds to #CMDSY without this.
@@ -232,15 +482,15 @@ class GenericHXProtocol(object):
         if flush_output:
             self.conn.flush_output()
         if flush_input:
-            self.conn.flush_input()
-        self.write(Message("#CMDSY"))
+            self.flush_input()
+        self.write(bytes(Message("#CMDSY")))
         r = self.receive()  # expect #CMDOK
         if r.type != "#CMDOK":
             logger.debug("Device failed to sync, trying harder")
             self.conn.flush_output()
             sleep(0.1)
-            self.conn.flush_input()
-            self.write(Message("#CMDSY"))
+            self.flush_input()
+            self.write(bytes(Message("#CMDSY")))
             r = self.receive()  # expect #CMDOK
             if r.type != "#CMDOK":
                 logger.debug("Device failed to sync, giving up")
@@ -258,7 +508,8 @@ class GenericHXProtocol(object):
         r = self.receive()  # expect #CMDOK
         if r.type != "#CMDOK":
             raise ProtocolError("Device did not acknowledge firmware version ack")
-        return cvrdq.args[0]
+        self.firmware_version = cvrdq.args[0]
+        return self.firmware_version
 
     def get_flash_id(self):
         # For some reason my radio sometimes responds with #CMDER. It only seems to work the
@@ -293,7 +544,13 @@ class GenericHXProtocol(object):
         # return cmdnd.args[0]
 
         # But this implements the check via a direct config flash read that works nonetheless:
-        return self.read_config_memory(0x100, 10).rstrip(b"\x00\xff").decode("ascii")
+        if self.flash_id is None:
+            self.flash_id = self.decode_flash_id(self.retrying("read", self.read_config_memory, *self.flash_id_range))
+        return self.flash_id
+
+    @staticmethod
+    def decode_flash_id(data: bytes) -> str:
+        return data.rstrip(b"\x00\xff").decode("ascii")
 
     def check_flash_id(self, flash_id: list):
         # This function would normally use the use the low-level implementation
@@ -309,10 +566,14 @@ class GenericHXProtocol(object):
             logger.warning(f"Flash ID mismatch. Device reported {fid}, expected {flash_id}")
             return False
 
-    def wait_for_ready(self, timeout=1):
+    def wait_for_ready(self, timeout=1, operation="status", force=False):
+        if self.ready and not force:
+            self.stats[f"{operation}_polls_skipped"] += 1
+            return
         timeout_time = time() + timeout
-        radio_status = None
-        while radio_status != "00" and time() < timeout_time:
+        delay = self.ready_poll_delay
+        while True:
+            self.stats[f"{operation}_polls"] += 1
             self.send("#CEPSR", ["00"])
             r = self.receive()  # expect #CMDOK
             if r.type != "#CMDOK":
@@ -321,28 +582,261 @@ class GenericHXProtocol(object):
             if r.type != "#CEPSD":
                 raise ProtocolError("Device did not return status")
             radio_status = r.args[0]
-            if radio_status != "00":
-                logger.debug("Waiting for radio, state=%s", radio_status)
             self.send("#CMDOK")
-        if radio_status != "00":
-            raise TimeoutError("Device not ready")
+            if radio_status == "00":
+                break
+            if time() >= timeout_time:
+                raise TimeoutError("Device not ready")
+            logger.debug("Waiting for radio, state=%s", radio_status)
+            sleep(min(delay, max(0.0, timeout_time - time())))
+            delay = min(2 * delay, self.ready_poll_max_delay)
+        self.ready = True
 
     def read_config_memory(self, offset, length):
-        self.wait_for_ready()
+        self.wait_for_ready(operation="read")
+        self.stats["read_blocks"] += 1
         self.send("#CEPRD", ["%04X" % offset, "%02X" % length])
         r = self.receive()  # expect #CMDOK
         if r.type != "#CMDOK":
+            self.ready = False
             raise ProtocolError("Device did not acknowledge read")
         d = self.receive()  # expect #CEPDT
-        if d.type != "#CEPDT":
+        if d.type != "#CEPDT" or len(d.args) != 3:
+            self.ready = False
             raise ProtocolError("Device did not reply with data")
         self.send("#CMDOK")
-        return unhexlify(d.args[2])
+        if not d.validate():
+            raise ProtocolError(f"Checksum mismatch in data read from 0x{offset:04x}")
+        data = unhexlify(d.args[2])
+        if len(data) != length:
+            raise ProtocolError(f"Device returned 0x{len(data):02x} bytes instead of 0x{length:02x} "
+                                f"from 0x{offset:04x}")
+        return data
+
+    def retrying(self, operation: str, function, *args):
+        """Run a single block transfer according to the retry policy"""
+        return self.retry_policy.call(self, operation, function, *args)
+
+    def transfer_block_size(self) -> int:
+        """
+        Block size for bulk config memory reads
+
+        Probes the radio for the largest block size it accepts on first use.
+        The probe only proves that reads work, so writes keep to the default block size.
+        Results are cached per flash ID and firmware version for the running process,
+        and handed to the block size listener for keeping them across runs.
+        """
+        if self.block_size is not None:
+            return self.block_size
+        key = (self.get_flash_id(), self.firmware_version)
+        if key in self.block_size_cache:
+            self.block_size = self.block_size_cache[key]
+        else:
+            self.block_size = self.probe_block_size()
+            self.block_size_cache[key] = self.block_size
+        self.__block_size_learned()
+        return self.block_size
+
+    def __block_size_learned(self):
+        if self.block_size_listener is not None:
+            self.block_size_listener(self.block_size)
+
+    def probe_block_size(self) -> int:
+        for size in self.block_size_candidates:
+            if size == self.default_block_size:
+                break
+            try:
+                data = self.read_config_memory(0x0000, size)
+            except (ProtocolError, TimeoutError):
+                # Some radios reject oversized reads, others silently ignore them
+                data = b""
+                self.ready = False
+                self.sync()
+            if len(data) == size:
+                logger.debug("Device accepts 0x%02x byte transfer blocks", size)
+                return size
+            logger.debug("Device rejects 0x%02x byte transfer blocks", size)
+        return self.default_block_size
+
+    def reduce_block_size(self):
+        """Fall back to the default block size after the radio rejected a larger one"""
+        if self.block_size is None or self.block_size <= self.default_block_size:
+            return False
+        logger.warning(f"Device rejected 0x{self.block_size:02x} byte block, "
+                       f"falling back to 0x{self.default_block_size:02x}")
+        self.block_size = self.default_block_size
+        self.block_size_cache[(self.flash_id, self.firmware_version)] = self.block_size
+        self.__block_size_learned()
+        return True
+
+    def read_config_ranges(self, ranges, window=1) -> list:
+        """
+        Read scattered config memory ranges with as few transfers as possible
+
+        Reads that cover the flash ID also fill the flash ID cache, so checking it
+        afterwards costs no extra transfer. Until the transfer block size is known,
+        reads are planned with the default block size instead of probing for it,
+        because probing needs the flash ID first.
+
+        :param ranges: iterable of (offset, length) tuples
+        :param window: int number of pipelined reads
+        :return: list of bytes, one per range
+        """
+        ranges = list(ranges)
+        block_size = self.block_size or self.default_block_size
+        # Replies are kept by the offset they actually cover, since rejected reads
+        # come back split into smaller blocks
+        replies = sorted(self.read_config_blocks(plan_config_reads(ranges, block_size), window=window))
+        reply_offsets = [offset for offset, _ in replies]
+        results = []
+        for offset, length in ranges:
+            result = bytearray()
+            position = offset
+            while position < offset + length:
+                index = bisect_right(reply_offsets, position) - 1
+                reply_offset, data = replies[index] if index >= 0 else (position, b"")
+                if position >= reply_offset + len(data):
+                    raise ProtocolError(f"Config memory at 0x{position:04x} missing from planned reads")
+                part = data[position - reply_offset:offset + length - reply_offset]
+                result += part
+                position += len(part)
+            results.append(bytes(result))
+        if self.flash_id is None:
+            flash_id_offset, flash_id_length = self.flash_id_range
+            for offset, data in replies:
+                if offset <= flash_id_offset and flash_id_offset + flash_id_length <= offset + len(data):
+                    try:
+                        self.flash_id = self.decode_flash_id(data[flash_id_offset - offset:
+                                                                  flash_id_offset - offset + flash_id_length])
+                    except UnicodeDecodeError:
+                        pass  # left for get_flash_id to fail on
+        return results
+
+    def read_config_blocks(self, blocks, window=1, max_attempts=None):
+        """
+        Pipelined config memory reader
+
+        Keeps up to `window` #CEPRD requests in flight and matches #CEPDT replies
+        by their address field, so the radio can work on the next request while
+        the host is still processing the previous reply. Blocks that fail are
+        re-issued individually, backing off according to the retry policy.
+
+        :param blocks: iterable of (offset, length) tuples
+        :param window: int maximum number of outstanding requests
+        :param max_attempts: int maximum number of requests per block, defaults to retry policy
+        :return: generator of (offset, data) tuples in order of arrival
+        """
+        if window < 1:
+            raise ValueError("Read window must be at least 1")
+        if max_attempts is None:
+            max_attempts = self.retry_policy.attempts
+
+        pending = deque(blocks)
+        attempts = Counter()
+        unacked = deque()  # requests sent, but not yet acknowledged by #CMDOK
+        in_flight = {}  # acknowledged requests waiting for #CEPDT, offset: length
+        retry_at = {}  # earliest time for re-issuing failed requests, offset: time
+
+        def retry(block, reason, rejected=False):
+            offset, length = block
+            self.stats["read_retries"] += 1
+            if rejected and length > self.default_block_size:
+                # Split blocks the radio won't accept instead of wasting attempts on them
+                self.reduce_block_size()
+                del attempts[offset]
+                for split_offset in range(offset, offset + length, self.default_block_size):
+                    split_length = min(self.default_block_size, offset + length - split_offset)
+                    pending.append((split_offset, split_length))
+                return
+            if attempts[offset] >= max_attempts:
+                self.stats["read_failures"] += 1
+                raise ProtocolError(f"Unable to read config memory at 0x{offset:04x}: {reason}")
+            logger.debug("Re-issuing read at 0x%04x: %s", offset, reason)
+            retry_at[offset] = time() + self.retry_policy.backoff_delay(attempts[offset])
+            pending.append(block)
+
+        while pending or unacked or in_flight:
+            while pending and len(unacked) + len(in_flight) < window:
+                if not self.ready:
+                    if unacked or in_flight:
+                        break  # Drain outstanding requests before polling status
+                    self.wait_for_ready(operation="read")
+                else:
+                    self.stats["read_polls_skipped"] += 1
+                offset, length = pending.popleft()
+                backoff = retry_at.pop(offset, 0.0) - time()
+                if backoff > 0:
+                    sleep(backoff)
+                attempts[offset] += 1
+                self.stats["read_blocks"] += 1
+                self.send("#CEPRD", ["%04X" % offset, "%02X" % length])
+                unacked.append((offset, length))
+
+            try:
+                r = self.receive()
+            except TimeoutError:
+                # Replies were lost on the line. Resync and re-issue everything outstanding.
+                lost = list(unacked) + list(in_flight.items())
+                unacked.clear()
+                in_flight.clear()
+                for block in lost:
+                    retry(block, "timeout")
+                self.ready = False
+                self.sync()
+                continue
+
+            if r.type == "#CMDOK":
+                if unacked:
+                    offset, length = unacked.popleft()
+                    in_flight[offset] = length
+                else:
+                    logger.debug("Ignoring unexpected acknowledgement")
+
+            elif r.type in ("#CMDER", "#CMDSM", "#CMDUN"):
+                # Radio rejected the oldest unacknowledged request
+                self.ready = False
+                if unacked:
+                    retry(unacked.popleft(), f"device replied {r.type}", rejected=r.type == "#CMDER")
+                else:
+                    logger.debug(f"Ignoring unexpected {r.type}")
+
+            elif r.type == "#CEPDT":
+                if len(r.args) != 3:
+                    self.send("#CMDOK")
+                    logger.debug(f"Ignoring malformed reply {str(r).strip()}")
+                    continue
+                offset = int(r.args[0], 16)
+                length = in_flight.pop(offset, None)
+                if length is None:
+                    # Some firmware might skip the #CMDOK when it replies straight away
+                    for block in unacked:
+                        if block[0] == offset:
+                            unacked.remove(block)
+                            length = block[1]
+                            break
+                    else:
+                        logger.debug("Ignoring data for unrequested address 0x%04x", offset)
+                        continue
+                self.send("#CMDOK")
+                if not r.validate():
+                    retry((offset, length), "checksum mismatch")
+                    continue
+                data = unhexlify(r.args[2])
+                if len(data) != length:
+                    retry((offset, length), "length mismatch")
+                    continue
+                yield offset, data
+
+            else:
+                raise ProtocolError(f"Unexpected reply during config read: {str(r).strip()}")
 
     def write_config_memory(self, offset, data):
-        self.wait_for_ready()
+        self.wait_for_ready(operation="write")
+        self.stats["write_blocks"] += 1
         data_string = hexlify(data).decode("ascii").upper()
         self.send("#CEPWR", ["%04X" % offset, "%02X" % len(data), data_string])
+        # The radio is busy flashing after every write
+        self.ready = False
         r = self.receive()  # expect #CMDOK
         if r.type != "#CMDOK":
             raise ProtocolError("Device did not acknowledge write")
@@ -436,8 +930,25 @@ class MediaTekProtocol(object):
             "full_stop": full_stop
         }
 
+    # Sector size of the GPS module's log flash memory
+    log_sector_size = 0x1000
+    # Log dump lines usually carry 24 words of four bytes each
+    log_line_size = 24 * 4
+
     def read_log(self, progress=False) -> bytes:
-        raw_log_data = b''
+        return b"".join(sector for _, _, sector in self.read_log_sectors(progress=progress))
+
+    def read_log_sectors(self, progress=False):
+        """
+        Generator reading the log, yielding every sector as soon as its last line has arrived
+
+        Log data is collected in a buffer that is preallocated for the number of lines
+        announced in the log header. Only a trailing partial sector is yielded after the
+        log footer.
+
+        :param progress: bool log progress reports
+        :return: generator of (line number, offset, sector data) tuples
+        """
         self.sync()
 
         # The radio behaves so erratically that the best option for now is not setting the baudrate at all
@@ -453,7 +964,11 @@ class MediaTekProtocol(object):
         if r.type != "$PMTK" or len(r.args) != 3 or r.args[0] != "LOX" or r.args[1] != "0":
             raise ProtocolError(f"Unexpected log header from device: {str(r).strip()}")
         number_of_lines = int(r.args[2])
-        received_line_numbers = []
+        raw_log_data = bytearray(number_of_lines * self.log_line_size)
+        size = 0
+        next_sector = 0
+        line_number = -1
+        next_line_number = 0
 
         # What follows is a flash memory dump of the log data
         # LOX messages with first arg "1" indicate a log dump line
@@ -468,22 +983,30 @@ class MediaTekProtocol(object):
             if len(r.args) == 2 and r.args[1] == "2":
                 # Received log footer
                 break
-            # Received log line with raw data
-            received_line_numbers.append(int(r.args[2]))
-            raw_waypoint_data = r.args[3:]
-            for word in raw_waypoint_data:
-                raw_log_data += unhexlify(word)
+            # Received log line with raw data. Did we receive the log in order?
+            line_number = int(r.args[2])
+            if line_number != next_line_number or line_number >= number_of_lines:
+                raise ProtocolError(f"Unexpected log dump sequence from device")
+            next_line_number += 1
+            raw_waypoint_data = unhexlify("".join(r.args[3:]))
+            raw_log_data[size:size + len(raw_waypoint_data)] = raw_waypoint_data
+            size += len(raw_waypoint_data)
+            while size - next_sector >= self.log_sector_size:
+                yield line_number, next_sector, bytes(raw_log_data[next_sector:next_sector + self.log_sector_size])
+                next_sector += self.log_sector_size
             if progress and time() - last_progress_report > 4:
-                percent_done = int(100.0 * len(received_line_numbers) / number_of_lines)
-                logger.info(f"{len(received_line_numbers)} / {number_of_lines} blocks ({percent_done}%)")
+                percent_done = int(100.0 * (line_number + 1) / number_of_lines)
+                logger.info(f"{line_number + 1} / {number_of_lines} blocks ({percent_done}%)")
                 last_progress_report = time()
 
         if progress:
             logger.info(f"{number_of_lines} / {number_of_lines} blocks (100%)")
 
-        # Did we receive the log in order and completely?
-        if received_line_numbers != list(range(number_of_lines)):
+        # Did we receive the log completely?
+        if next_line_number != number_of_lines:
             raise ProtocolError(f"Unexpected log dump sequence from device")
+        if size > next_sector:
+            yield line_number, next_sector, bytes(raw_log_data[next_sector:size])
 
         # Radio acknowledges ReadLog command
         r = self.receive()
@@ -502,8 +1025,6 @@ class MediaTekProtocol(object):
         # self.mtk_sync()
         # self.mtk_sync()
 
-        return raw_log_data
-
     def erase_log(self):
         # EraseLog command to radio
         self.send("$PMTK", ["184", "1"])
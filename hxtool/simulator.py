@@ -8,7 +8,8 @@ from pty import openpty
 from threading import Event, Thread
 from time import time
 
-from .protocol import Message
+from .locus import Locus, LocusError
+from .protocol import Message, MessageDecoder, ProtocolError
 
 logger = getLogger(__name__)
 
@@ -17,6 +18,8 @@ class HXSimulator(Thread):
 
     instances = []
     loop_delay_default = 1 / 38400
+    gps_log_default = b""
+    gps_log_sectors = 32  # capacity of the GPS module's log flash
 
     @classmethod
     def register(cls, instance):
@@ -34,7 +37,8 @@ class HXSimulator(Thread):
             instance.join()
 
     def __init__(self, mode: str, config: bytearray or None = None,
-                 loop_delay: float = None, nmea_delay: float = 3.0):
+                 loop_delay: float = None, nmea_delay: float = 3.0, max_block_size: int = 0x80,
+                 gps_log: bytes or None = None):
         super().__init__()
         HXSimulator.register(self)
         self.id = HXSimulator.instances.index(self)
@@ -47,9 +51,21 @@ class HXSimulator(Thread):
         self.stop_running = Event()
         self.loop_delay = loop_delay or self.loop_delay_default
         self.nmea_delay = nmea_delay
+        self.max_block_size = max_block_size
+        # Some radios don't reply at all to reads larger than they support
+        self.ignore_oversized_reads = False
+        # Config memory offsets that fail to read, for simulating flaky connections
+        self.read_errors = set()
+        # Number of upcoming reads and writes answered with a checksum error
+        self.transfer_errors = 0
+        self.gps_log = gps_log or self.gps_log_default
+        # Output that didn't fit into the pty at once, like GPS log dumps
+        self.output = bytearray()
         # FIXME: This will fail on Windows (probably on import)
         set_blocking(self.master, False)
-        self.ignore_cmdok = False
+        # Number of replies still waiting for the host's #CMDOK. Counting them
+        # allows the host to pipeline requests.
+        self.pending_acks = 0
 
     def run(self):
         if self.stop_running.is_set():
@@ -64,34 +80,53 @@ class HXSimulator(Thread):
     def stop(self):
         self.stop_running.set()
 
+    def __read_input(self):
+        try:
+            return read(self.master, 4096)
+        except BlockingIOError:
+            return b""
+
+    def __flush_output(self):
+        try:
+            written = write(self.master, self.output)
+        except BlockingIOError:
+            return
+        del self.output[:written]
+
+    @staticmethod
+    def __decode(decoder, data):
+        # Broken messages are passed on as ProtocolError instances, so
+        # decoding can continue with whatever follows them.
+        items = decoder.feed(data)
+        while True:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            except ProtocolError as e:
+                item = e
+                items = decoder.decode()
+            yield item
+
     def __run_nmea_mode(self):
         logger.debug("Starting simulator thread in NMEA mode")
-        message = b""
+        decoder = MessageDecoder()
         next_message_time = time() + self.nmea_delay
         while not self.stop_running.wait(self.loop_delay):
-            try:
-                b = read(self.master, 1)
-            except BlockingIOError:
-                b = b""
-            if len(b) > 0:
-                # We have input and all NMEA messages start with $
-                if len(message) > 0:
-                    # If we are receiving part of a message, append
-                    # input to message buffer until newline received.
-                    message += b
-                    if message.endswith(b"\r\n"):
-                        # If line is complete, process message
-                        self.__process_nmea_message(message)
-                        message = b""
-                elif b == b"$":
-                    message = b
-                elif b == b"P":
-                    # Reply with P to P to signal NMEA mode
-                    logger.debug("NMEA simulator responding to ping")
-                    write(self.master, b"P")
-                else:
-                    # Ignore all other bytes outside of messages
-                    logger.debug(f"NMEA simulator ignoring unexpected input {b}")
+            data = self.__read_input()
+            if len(data) > 0:
+                for item in self.__decode(decoder, data):
+                    if isinstance(item, Message):
+                        self.__process_nmea_message(item)
+                    elif isinstance(item, ProtocolError):
+                        logger.debug(f"NMEA simulator ignoring broken message: {item}")
+                    elif item == b"P":
+                        # Reply with P to P to signal NMEA mode
+                        logger.debug("NMEA simulator responding to ping")
+                        write(self.master, b"P")
+                    else:
+                        # Ignore all other bytes outside of messages
+                        logger.debug(f"NMEA simulator ignoring unexpected input {item}")
             else:
                 # No input, so check whether it's time to send
                 # a dummy NMEA message.
@@ -103,56 +138,46 @@ class HXSimulator(Thread):
         logger.debug("NMEA simulator thread finished")
 
     def __process_nmea_message(self, msg):
-        logger.debug(f"NMEA simulator processing message {msg}")
+        logger.debug(f"NMEA simulator processing message {msg!r}")
 
     def __run_cp_mode(self):
         logger.debug("Starting simulator thread in CP mode")
-        message = b""
+        decoder = MessageDecoder()
         while not self.stop_running.wait(self.loop_delay):
-            try:
-                b = read(self.master, 1)
-            except BlockingIOError:
-                b = b""
-            if len(b) > 0:
-                logger.debug(f"CP mode got {b}")
-                # We have input and all NMEA messages start with $
-                if len(message) > 0:
-                    # If we are receiving part of a message, append
-                    # input to message buffer until newline received.
-                    message += b
-                    if message.endswith(b"\r\n"):
-                        # If line is complete, process message
-                        if message.startswith(b"0"):
-                            # The real HX870 doesn't react to the 0ACMD:002
-                            logger.debug(f"CP simulator ignoring message {message}")
-                        else:
-                            self.__process_cp_message(message)
-                        message = b""
-                elif b == b"0":
-                    # Beginning of 0ACMD:002 message?
-                    message = b
-                elif b == b"#":
-                    # Beginning of a #-style command
-                    message = b
-                elif b == b"?":
+            if len(self.output) > 0:
+                # Finish pending output before processing more input
+                self.__flush_output()
+                continue
+            data = self.__read_input()
+            if len(data) == 0:
+                continue
+            logger.debug(f"CP mode got {data}")
+            # Stray bytes include the 0ACMD:002 command mode request. The real HX870
+            # doesn't react to it, so it is simply ignored along with everything else.
+            for item in self.__decode(decoder, data):
+                if isinstance(item, Message):
+                    self.__process_cp_message(item)
+                elif isinstance(item, ProtocolError):
+                    logger.debug(f"CP simulator received broken message: {item}")
+                    write(self.master, bytes(Message("#CMDER")))
+                elif item == b"?":
                     # Reply with @ to ? to signal CP mode
                     logger.debug("CP simulator responding to ping")
                     write(self.master, b"@")
                 else:
                     # Ignore all other bytes outside of messages
-                    logger.debug(f"CP simulator ignoring unexpected input {b}")
+                    logger.debug(f"CP simulator ignoring unexpected input {item}")
 
         logger.debug("CP simulator thread finished")
 
     def __process_cp_message(self, msg):
-        logger.debug(f"CP simulator processing message {msg}")
-        msg = Message(parse=msg)
+        logger.debug(f"CP simulator processing message {msg!r}")
         if not msg.validate():
             write(self.master, bytes(Message("#CMDER")))
             return
         if msg.type == "#CMDOK":
-            if self.ignore_cmdok:
-                self.ignore_cmdok = False
+            if self.pending_acks > 0:
+                self.pending_acks -= 1
             else:
                 write(self.master, bytes(Message("#CMDOK")))
         elif msg.type == "#CMDSY":
@@ -163,25 +188,64 @@ class HXSimulator(Thread):
         elif msg.type == "#CEPSR":
             write(self.master, bytes(Message("#CMDOK")))
             write(self.master, bytes(Message("#CEPSD", ["00"])))
-            self.ignore_cmdok = True
+            self.pending_acks += 1
+        elif msg.type in ("#CEPRD", "#CEPWR") and self.transfer_errors > 0:
+            self.transfer_errors -= 1
+            write(self.master, bytes(Message("#CMDSM")))
         elif msg.type == "#CEPRD":
-            write(self.master, bytes(Message("#CMDOK")))
             offset = int(msg.args[0], 16)
             size = int(msg.args[1], 16)
+            if size > self.max_block_size and self.ignore_oversized_reads:
+                return
+            if size > self.max_block_size or not self.read_errors.isdisjoint(range(offset, offset + size)):
+                write(self.master, bytes(Message("#CMDER")))
+                return
+            write(self.master, bytes(Message("#CMDOK")))
             data = hexlify(self.c[offset:offset + size]).decode("ascii").upper()
             write(self.master, bytes(Message("#CEPDT", [msg.args[0], msg.args[1], data])))
-            # Ignore next CMDOK
-            self.ignore_cmdok = True
+            # Ignore CMDOK acknowledging the data
+            self.pending_acks += 1
         elif msg.type == "#CEPWR":
             offset = int(msg.args[0], 16)
             size = int(msg.args[1], 16)
             data = unhexlify(msg.args[2])
-            if len(data) == size:
+            if len(data) == size and size <= self.max_block_size:
                 self.c[offset:offset + size] = data
                 write(self.master, bytes(Message("#CMDOK")))
                 if len(self.c) != 1 << 15:
                     logger.critical("CP simulator internal memory corruption after write")
             else:
                 write(self.master, bytes(Message("#CMDER")))
+        elif msg.type == "$PMTK":
+            self.__process_gps_message(msg)
         else:
             write(self.master, bytes(Message("#CMDER")))
+
+    def __process_gps_message(self, msg):
+        # The GPS module is reachable through CP mode
+        if msg.args == ["000"]:
+            write(self.master, bytes(Message("$PMTK", ["001", "0", "3"])))
+        elif msg.args == ["605"]:
+            write(self.master, bytes(Message("$PMTK", ["705", "AXN_2.31_3339_13101700", "5632", "PA6H", "1.0"])))
+        elif msg.args == ["183"]:
+            # Log status: pages used, overlap logging in interval mode every 5s, enabled, slots used, % full
+            pages = -(-len(self.gps_log) // 0x1000)
+            try:
+                slots = len(Locus(self.gps_log))
+            except LocusError:
+                slots = 0
+            usage = 100 * pages // self.gps_log_sectors
+            self.output += bytes(Message("$PMTK", ["LOG", str(pages), "0", "8", "127", "5", "0", "0", "0",
+                                                   str(slots), str(usage)]))
+            self.output += bytes(Message("$PMTK", ["001", "183", "3"]))
+        elif msg.args == ["622", "1"]:
+            # Log dump is sent in lines of 24 words
+            lines = [self.gps_log[offset:offset + 96] for offset in range(0, len(self.gps_log), 96)]
+            self.output += bytes(Message("$PMTK", ["LOX", "0", str(len(lines))]))
+            for number, line in enumerate(lines):
+                words = [hexlify(line[i:i + 4]).decode("ascii").upper() for i in range(0, len(line), 4)]
+                self.output += bytes(Message("$PMTK", ["LOX", "1", str(number)] + words))
+            self.output += bytes(Message("$PMTK", ["LOX", "2"]))
+            self.output += bytes(Message("$PMTK", ["001", "622", "3"]))
+        else:
+            write(self.master, bytes(Message("$PMTK", ["001", msg.args[0], "1"])))  # invalid command
@@ -2,6 +2,7 @@
 
 from logging import getLogger
 from serial import Serial
+from time import time
 
 logger = getLogger(__name__)
 
@@ -24,38 +25,73 @@ class GenericHXTTY(object):
         self.s = Serial(tty, timeout=timeout)
         self.s.flushInput()
         self.s.flushOutput()
+        # Input is read in bulk and framed from this buffer, because
+        # Serial.readline() costs a system call per byte.
+        self.buffer = bytearray()
+
+    def close(self):
+        self.s.close()
 
     def write(self, data):
         logger.debug("OUT: %s" % repr(data))
         return self.s.write(data)
 
-    def read(self, *args, **kwargs):
-        result = self.s.read(*args, **kwargs)
+    def __fill(self):
+        """Read everything the port has waiting, but block for at least one byte"""
+        data = self.s.read(max(1, self.s.in_waiting))
+        self.buffer += data
+        return len(data)
+
+    def __take(self, size):
+        result = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return result
+
+    def read(self, size=1):
+        if len(self.buffer) < size:
+            self.buffer += self.s.read(size - len(self.buffer))
+        result = self.__take(size)
         logger.debug("  IN: %s", repr(result))
         if len(result) == 0:
             raise TimeoutError(f"{self.tty} read() timeout")
         return result
 
     def read_all(self):
-        result = self.s.read_all()
+        self.buffer += self.s.read_all()
+        result = self.__take(len(self.buffer))
         if len(result) == 0:
             raise TimeoutError(f"{self.tty} read_all() timeout")
         logger.debug("  IN: %s", repr(result))
         return result
 
-    def read_line(self, *args, **kwargs):
-        result = self.s.readline(*args, **kwargs)
+    def read_line(self):
+        # Same timeout semantics as Serial.readline(): Every read may block for the full
+        # timeout, and a line that is incomplete when the timeout expires is returned as is.
+        timeout_time = None if self.s.timeout is None else time() + self.s.timeout
+        while True:
+            end = self.buffer.find(b"\n")
+            if end >= 0:
+                result = self.__take(end + 1)
+                break
+            if timeout_time is not None and time() >= timeout_time:
+                result = self.__take(len(self.buffer))
+                break
+            if self.__fill() == 0:
+                result = self.__take(len(self.buffer))
+                break
         if len(result) == 0:
             raise TimeoutError(f"{self.tty} read_line() timeout")
         logger.debug("  IN: %s", repr(result))
         return result
 
     def available(self):
-        return self.s.in_waiting
+        return len(self.buffer) + self.s.in_waiting
 
     def flush_input(self):
-        if self.s.in_waiting > 0:
-            logger.warning(f"{self.tty} flushing {self.s.in_waiting} bytes from input buffer")
+        waiting = len(self.buffer) + self.s.in_waiting
+        if waiting > 0:
+            logger.warning(f"{self.tty} flushing {waiting} bytes from input buffer")
+        self.buffer.clear()
         return self.s.flushInput()
 
     def flush_output(self):
@@ -7,7 +7,6 @@ PACKAGE_VERSION = '0.3.1a2'
 
 INSTALL_REQUIRES = [
     'coloredlogs',
-    'gpxpy',
     'ipython',
     'pyserial'
 ]
@@ -22,6 +21,10 @@ TESTS_REQUIRE = [
 
 DEV_REQUIRES = TESTS_REQUIRE
 
+GPXPY_REQUIRES = [
+    'gpxpy'
+]
+
 setup(
     name=PACKAGE_NAME,
     version=PACKAGE_VERSION,
@@ -52,7 +55,7 @@ setup(
     use_2to3=False,
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
-    extras_require={'dev': DEV_REQUIRES},  # For `pip install -e .[dev]`
+    extras_require={'dev': DEV_REQUIRES, 'gpxpy': GPXPY_REQUIRES},  # For `pip install -e .[dev]`
     entry_points={
         'console_scripts': [
             'hxtool = hxtool.main:main'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hxtool import cache
+
+
+def test_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert cache.cache_dir("gpslog") == str(tmp_path / "hxtool" / "gpslog")
+    assert cache.cache_key("AM057N", "123456789") == "AM057N_123456789"
+    assert cache.cache_key("../x y", None) == "..xy_None"
+    assert cache.cache_key("", "FFFFFFFFF") == "none_FFFFFFFFF"
+
+
+def test_gps_log_cache(tmp_path):
+    status = {"pages_used": 2, "slots_used": 300, "full_stop": False}
+    data = bytes(range(256)) * 32
+
+    c = cache.GpsLogCache("radio", directory=str(tmp_path))
+    assert c.status is None and c.data == b""
+    assert not c.is_current(status)
+    assert c.is_changed(0, data[:0x1000])
+
+    c.store(status, data)
+    c = cache.GpsLogCache("radio", directory=str(tmp_path))
+    assert c.is_current(status)
+    assert not c.is_current(dict(status, slots_used=301)), "new trackpoints invalidate cache"
+    assert c.data == data
+    assert not c.is_changed(0x1000, data[0x1000:0x2000])
+    assert c.is_changed(0x1000, b"\xaa" + data[0x1001:0x2000])
+    assert c.is_changed(0x2000, b"\xff" * 0x1000), "sectors beyond cached log are new"
+    assert not cache.GpsLogCache("other", directory=str(tmp_path)).is_current(status)
+
+    (tmp_path / "radio.bin").write_bytes(data[:-1])
+    assert cache.GpsLogCache("radio", directory=str(tmp_path)).status is None, "truncated cache is ignored"
+
+    c.clear()
+    assert cache.GpsLogCache("radio", directory=str(tmp_path)).status is None
+
+
+class PortInfo(object):
+
+    def __init__(self, serial_number, location):
+        self.serial_number = serial_number
+        self.location = location
+
+
+def test_device_identity_cache(tmp_path):
+    file_name = str(tmp_path / "devices.json")
+    assert cache.DeviceIdentityCache.key(PortInfo(None, None)) is None
+    key = cache.DeviceIdentityCache.key(PortInfo("0123", "1-1.2"))
+    assert key == "0123_1-1.2"
+
+    c = cache.DeviceIdentityCache(file_name)
+    assert c.get(key) == {}
+    c.update(key, model="HX870", flash_id=None, firmware_version="1.00", mode="CP")
+    c.update(key, flash_id="AM057N")
+    c = cache.DeviceIdentityCache(file_name)
+    assert c.get(key) == {"model": "HX870", "flash_id": "AM057N", "firmware_version": "1.00", "mode": "CP"}
+
+    c.invalidate(key)
+    assert cache.DeviceIdentityCache(file_name).get(key) == {}
+
+    (tmp_path / "devices.json").write_text("[]")
+    assert cache.DeviceIdentityCache(file_name).entries == {}, "inconsistent cache is ignored"
+
+
+def test_concurrent_atomic_writes(tmp_path):
+    file_name = str(tmp_path / "entry.bin")
+    payloads = [bytes([n]) * 0x1000 for n in range(4)]
+
+    def write(payload):
+        for _ in range(100):
+            cache.write_atomically(file_name, payload)
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+        list(pool.map(write, payloads))
+    assert (tmp_path / "entry.bin").read_bytes() in payloads, "file is never torn"
+    assert [p.name for p in tmp_path.iterdir()] == ["entry.bin"], "no temp files are left behind"
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pytest
+from random import getrandbits
 from sys import platform
 
 from hxtool import config, protocol, simulator
@@ -19,6 +20,276 @@ def fixture_cp_simulator():
     s.join(timeout=1)
 
 
+@pytest.fixture(name="kill_sims")
+def kill_simulator_threads_fixture():
+    yield None
+    simulator.HXSimulator.stop_instances()
+    simulator.HXSimulator.join_instances()
+
+
 @pytest.fixture(name="sim_config")
 def fixture_config_simulator(cp_sim):
     yield config.HX870Config(protocol.GenericHXProtocol(cp_sim.tty))
+
+
+def random_config():
+    config_data = bytearray(getrandbits(8) for _ in range(0x8000))
+    config_data[0x100:0x10a] = b"AM057N\xff\xff\xff\xff"  # flash ID
+    config_data[0x4300:0x5c00] = b"\xff" * 0x1900  # no waypoints
+    return config_data
+
+
+@pytest.fixture(name="random_sim")
+def fixture_random_simulator():
+    s = simulator.HXSimulator(mode="CP", config=random_config(), loop_delay=0.0001)
+    s.start()
+    yield s
+    s.stop()
+    s.join(timeout=1)
+
+
+def test_pipelined_config_read(random_sim):
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    blocks = [(offset, 0x40) for offset in range(0x1000, 0x1800, 0x40)]
+    for window in 1, 4, 16:
+        data = dict(p.read_config_blocks(blocks, window=window))
+        assert sorted(data.keys()) == [offset for offset, _ in blocks], f"all blocks read with window {window}"
+        for offset, block in data.items():
+            assert block == random_sim.c[offset:offset + 0x40], f"block 0x{offset:04x} read correctly"
+    with pytest.raises(ValueError):
+        _ = list(p.read_config_blocks(blocks, window=0))
+
+
+@pytest.mark.slow
+def test_config_read(random_sim):
+    c = config.HX870Config(protocol.GenericHXProtocol(random_sim.tty))
+    assert c.config_read(window=8) == random_sim.c
+
+
+def test_ready_tracking(random_sim):
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    for offset in range(0x0000, 0x0200, 0x40):
+        assert p.read_config_memory(offset, 0x40) == random_sim.c[offset:offset + 0x40]
+    assert p.stats["read_polls"] == 1, "status is only polled before the first read"
+    assert p.stats["read_polls_skipped"] == 7, "status polls are skipped for consecutive reads"
+
+    p.write_config_memory(0x1000, b"\x01\x02")
+    p.write_config_memory(0x1002, b"\x03\x04")
+    assert p.stats["write_polls_skipped"] == 1, "status poll is skipped for writing after a read"
+    assert p.stats["write_polls"] == 1, "status is polled for writing after a write"
+    assert p.read_config_memory(0x1000, 4) == b"\x01\x02\x03\x04"
+    assert p.stats["read_polls"] == 2, "status is polled before reading after a write"
+
+
+def test_block_size_probing(kill_sims):
+    del kill_sims
+    protocol.GenericHXProtocol.block_size_cache.clear()
+    config_data = random_config()
+    small_sim = simulator.HXSimulator(mode="CP", config=config_data, loop_delay=0.0001, max_block_size=0x40)
+    large_sim = simulator.HXSimulator(mode="CP", config=config_data, loop_delay=0.0001, max_block_size=0x80)
+    small_sim.start()
+    large_sim.start()
+
+    p = protocol.GenericHXProtocol(small_sim.tty)
+    assert p.transfer_block_size() == 0x40, "block size probing falls back to default"
+    assert protocol.GenericHXProtocol.block_size_cache[("AM057N", None)] == 0x40
+
+    protocol.GenericHXProtocol.block_size_cache.clear()
+    p = protocol.GenericHXProtocol(large_sim.tty)
+    assert p.transfer_block_size() == 0x80, "block size probing detects larger blocks"
+    c = config.HX870Config(p)
+    assert c.read_waypoints() == []
+    c.image.write(0x2000, bytes(0x80))
+    assert p.stats["write_blocks"] == 2, "writes keep to default block size"
+    assert large_sim.c[0x2000:0x2080] == bytes(0x80)
+
+    # Pretend the radio stopped accepting large blocks
+    large_sim.max_block_size = 0x40
+    blocks = list(config.split_range(0x2000, 0x2200, p.block_size))
+    data = dict(p.read_config_blocks(blocks))
+    assert p.block_size == 0x40, "bulk reads fall back to default block size"
+    assert sorted(data.keys()) == list(range(0x2000, 0x2200, 0x40))
+    assert b"".join(data[k] for k in sorted(data.keys())) == config_data[0x2000:0x2200]
+
+
+def test_silent_block_size_probing(kill_sims):
+    del kill_sims
+    protocol.GenericHXProtocol.block_size_cache.clear()
+    sim = simulator.HXSimulator(mode="CP", config=random_config(), loop_delay=0.0001, max_block_size=0x40)
+    sim.ignore_oversized_reads = True
+    sim.start()
+
+    p = protocol.GenericHXProtocol(sim.tty)
+    p.conn.s.timeout = 0.2
+    assert p.transfer_block_size() == 0x40, "radio ignoring large reads falls back to default"
+    assert p.read_config_memory(0x0100, 6) == b"AM057N", "connection is usable after probing"
+    protocol.GenericHXProtocol.block_size_cache.clear()
+
+
+def test_split_range():
+    assert list(config.split_range(0x0010, 0x0100, 0x40)) == [(0x10, 0x30), (0x40, 0x40), (0x80, 0x40), (0xc0, 0x40)]
+    assert list(config.split_range(0x7f80, 0x7ffe, 0x80)) == [(0x7f80, 0x7e)]
+    assert list(config.split_range(0x0002, 0x000f, 0x80)) == [(0x02, 0x0d)]
+
+
+def test_differential_config_write(random_sim):
+    c = config.HX870Config(protocol.GenericHXProtocol(random_sim.tty))
+    data = bytearray(random_sim.c)
+    data[0x00b0:0x00b6] = b"\x21\x14\x56\x78\x90\x02"  # MMSI
+    data[0x2345] ^= 0xff
+    data[0x7ffd] ^= 0xff
+
+    blocks = len(list(config.split_range(0x0002, 0x000f, 0x40)))
+    blocks += len(list(config.split_range(0x0010, 0x7ffe, 0x40)))
+
+    report = c.config_write(bytes(data), diff=True)
+    assert report == {"written": 3, "skipped": blocks - 3, "verified": 3}
+    assert random_sim.c == data
+    assert c.p.stats["write_blocks"] == 3
+
+    report = c.config_write(bytes(data), diff=True, current=bytes(data))
+    assert report == {"written": 0, "skipped": blocks, "verified": 0}, "nothing to write for identical config"
+    assert c.p.stats["write_blocks"] == 3
+
+    with pytest.raises(protocol.ProtocolError):
+        _ = c.config_write(b"\xff" + bytes(data[1:]), diff=True, current=bytes(data))
+
+    base = bytearray(data)
+    base[0x0000] ^= 0xff  # magic is checked against the device, not the given current config
+    with pytest.raises(protocol.ProtocolError):
+        _ = c.config_write(bytes(base), diff=True, current=bytes(base))
+    assert c.p.stats["write_blocks"] == 3
+
+
+def test_config_image(random_sim):
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    image = config.ConfigImage(p, autoflush=False)
+
+    assert image.read(0x00b0, 6) == random_sim.c[0x00b0:0x00b6]
+    reads = p.stats["read_blocks"]
+    assert image.read(0x00a2, 1) == random_sim.c[0x00a2:0x00a3]
+    assert image.read(0x00b6, 6) == random_sim.c[0x00b6:0x00bc]
+    assert p.stats["read_blocks"] == reads, "reads within cached block are served from memory"
+    with pytest.raises(protocol.ProtocolError):
+        _ = image.read(0x7ffe, 4)
+
+    image.write(0x1000, b"\x01\x02")
+    image.write(0x1002, b"\x03\x04")
+    image.write(0x1100, bytes(random_sim.c[0x1100:0x1110]))  # unchanged data is not written
+    assert image.read(0x1000, 4) == b"\x01\x02\x03\x04"
+    assert random_sim.c[0x1000:0x1004] != b"\x01\x02\x03\x04", "writes are held back until flush"
+    assert image.flush() == 1, "adjacent writes are coalesced"
+    assert random_sim.c[0x1000:0x1004] == b"\x01\x02\x03\x04"
+    assert p.stats["write_blocks"] == 1
+
+    with pytest.raises(RuntimeError):
+        with image.transaction():
+            image.write(0x2000, b"\x05\x06")
+            raise RuntimeError("abort")
+    assert image.dirty == []
+    assert image.read(0x2000, 2) == random_sim.c[0x2000:0x2002], "aborted writes are dropped"
+
+    with image.transaction():
+        image.write(0x2000, b"\x05\x06")
+        image.write(0x2040, b"\x07\x08")
+    assert random_sim.c[0x2000:0x2002] == b"\x05\x06"
+    assert random_sim.c[0x2040:0x2042] == b"\x07\x08"
+
+
+def test_read_planner(random_sim):
+    fields = [(0x00b0, 6), (0x00b6, 6), (0x00a2, 1), (0x0100, 10), (0x010f, 1)]
+    assert protocol.plan_config_reads(fields, 0x80) == [(0x00a2, 0x1a), (0x0100, 0x10)]
+    assert protocol.plan_config_reads(fields, 0x40) == [(0x00a2, 0x1a), (0x0100, 0x10)]
+    assert protocol.plan_config_reads([(0x0030, 0x20), (0x0038, 4)], 0x40) == [(0x0030, 0x10), (0x0040, 0x10)]
+    assert protocol.plan_config_reads([(0x1000, 0)], 0x40) == []
+
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    block_size = p.transfer_block_size()
+    reads = p.stats["read_blocks"]
+    results = p.read_config_ranges(fields + [(0x0030, 0x20)])
+    assert results == [random_sim.c[offset:offset + length] for offset, length in fields + [(0x0030, 0x20)]]
+    assert p.stats["read_blocks"] - reads == len(protocol.plan_config_reads(fields + [(0x0030, 0x20)], block_size))
+
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    c = config.HX870Config(p)
+    c.prefetch(c.info_fields)
+    assert p.flash_id == "AM057N", "planned reads covering the flash ID fill its cache"
+    assert p.block_size is None, "reads are planned without probing the block size"
+    assert p.stats["read_blocks"] == 2
+    c.read_mmsi()
+    c.read_atis()
+    c.read_region_code()
+    assert p.stats["read_blocks"] == 2, "info fields are read with two transfers"
+
+
+def test_read_planner_rejected_blocks(random_sim):
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    p.block_size = 0x80
+    random_sim.max_block_size = 0x40
+    fields = [(0x0010, 4), (0x0050, 4), (0x00f0, 0x20)]
+    results = p.read_config_ranges(fields, window=1)
+    assert p.block_size == 0x40, "rejected large reads fall back to default block size"
+    assert results == [random_sim.c[offset:offset + length] for offset, length in fields], \
+        "split replies are matched to the ranges they cover"
+    protocol.GenericHXProtocol.block_size_cache.clear()
+
+
+def test_resumable_config_dump(random_sim, tmp_path):
+    dump_file = str(tmp_path / "config.dat")
+    random_sim.read_errors = {0x6010}
+    c = config.HX870Config(protocol.GenericHXProtocol(random_sim.tty))
+    with pytest.raises(protocol.ProtocolError):
+        c.config_dump(dump_file)
+    assert (tmp_path / "config.dat.progress").exists(), "interrupted dump leaves progress behind"
+    partial = config.ConfigDump(dump_file, flash_id="AM057N")
+    assert partial.load()
+    assert partial.missing() == [(0x6000, 0x6040)], "blocks read before and after failure are kept"
+
+    random_sim.read_errors = set()
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    c = config.HX870Config(p)
+    p.get_flash_id()
+    p.transfer_block_size()
+    reads = p.stats["read_blocks"]
+    assert c.config_dump(dump_file, resume=True), "interrupted dump is resumed"
+    assert p.stats["read_blocks"] - reads == 1, "only missing blocks are read"
+    assert (tmp_path / "config.dat").read_bytes() == random_sim.c
+    assert not (tmp_path / "config.dat.progress").exists(), "progress is removed after complete dump"
+
+    assert not c.config_dump(dump_file, resume=True), "complete dump starts from scratch"
+    assert (tmp_path / "config.dat").read_bytes() == random_sim.c
+
+    partial.flash_id = "AM999N"
+    partial.save()
+    with pytest.raises(protocol.ProtocolError):
+        c.config_dump(dump_file, resume=True)
+    protocol.GenericHXProtocol.block_size_cache.clear()
+
+
+def test_retry_policy(random_sim):
+    policy = protocol.RetryPolicy(attempts=3, delay=0.001, max_delay=0.003)
+    assert [policy.backoff_delay(attempt) for attempt in (1, 2, 3)] == [0.001, 0.002, 0.003]
+
+    p = protocol.GenericHXProtocol(random_sim.tty)
+    p.retry_policy = policy
+    p.transfer_block_size()
+    random_sim.transfer_errors = 2
+    assert p.retrying("read", p.read_config_memory, 0x0100, 6) == b"AM057N"
+    assert p.stats["read_retries"] == 2
+
+    image = config.ConfigImage(p)
+    image.load(0x1000, 4)
+    random_sim.transfer_errors = 1
+    image.write(0x1000, b"\x01\x02\x03\x04")
+    assert random_sim.c[0x1000:0x1004] == b"\x01\x02\x03\x04", "failed write is retried"
+    assert p.stats["write_retries"] == 1
+
+    random_sim.transfer_errors = 3
+    c = config.HX870Config(p)
+    assert c.config_read(window=4) == random_sim.c, "failed blocks in bulk reads are retried"
+    assert p.stats["read_retries"] == 5
+
+    random_sim.transfer_errors = 3
+    with pytest.raises(protocol.ProtocolError):
+        image.write(0x1000, b"\x05\x06\x07\x08")
+    assert p.stats["write_failures"] == 1, "retries are limited"
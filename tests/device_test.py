@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from sys import platform
+from threading import Event
+from types import SimpleNamespace
+from time import sleep, time
+
+from hxtool import cache, device, simulator
+from hxtool.cli import gpslog
+
+# The simulator doesn't work on Windows, so skip test if running on Windows
+if platform.startswith("win"):
+    pytest.skip("Skipping simulator tests on Windows", allow_module_level=True)
+
+
+@pytest.fixture(name="kill_sims")
+def kill_simulator_threads_fixture():
+    yield None
+    simulator.HXSimulator.stop_instances()
+    simulator.HXSimulator.join_instances()
+
+
+class SlowPort(object):
+    """Stands in for a device class whose port takes a while to answer"""
+
+    delays = {}
+    closed = Event()
+
+    def __init__(self, tty):
+        self.tty = tty
+        sleep(self.delays.get(tty, 0.0))
+        if tty == "broken":
+            raise OSError("No such port")
+
+    def close(self):
+        self.closed.set()
+
+
+def test_parallel_probe():
+    SlowPort.delays = {"a": 0.2, "b": 0.1, "hung": 1.0}
+    start = time()
+    devices = device.probe([(SlowPort, tty) for tty in ("a", "hung", "broken", "b", "c")], timeout=0.5)
+    assert time() - start < 0.9, "ports are probed in parallel and hung ports are left behind"
+    assert [d.tty for d in devices] == ["a", "b", "c"], "devices come back in candidate order"
+    assert SlowPort.closed.wait(timeout=2), "late devices are closed"
+
+
+def test_probe_simulators(kill_sims):
+    del kill_sims
+    cp_sim = simulator.HXSimulator(mode="CP")
+    nmea_sim = simulator.HXSimulator(mode="NMEA")
+    cp_sim.start()
+    nmea_sim.start()
+    devices = device.probe([(device.HXSim, cp_sim.tty), (device.HXSim, nmea_sim.tty)])
+    assert [d.tty for d in devices] == [cp_sim.tty, nmea_sim.tty]
+    assert devices[0].cp_mode and not devices[1].cp_mode
+
+
+def test_lazy_device_handles(kill_sims):
+    del kill_sims
+    handles = device.list_devices(add_simulator=True)
+    assert [h.model for h in handles[:2]] == [device.HXSim, device.HXSim]
+    assert handles[0].serial_number is None, "simulators have no USB metadata"
+
+    devices = device.enumerate(force_device="1", add_simulator=True)
+    assert len(devices) == 1
+    assert devices[0].comm.nmea_mode, "numeric selector picks second simulator"
+    assert device.enumerate(force_device="99", add_simulator=True) == []
+
+
+def test_identity_cache(kill_sims, tmp_path, monkeypatch):
+    del kill_sims
+    identities = cache.DeviceIdentityCache(str(tmp_path / "devices.json"))
+    monkeypatch.setattr(device, "identity_cache", identities)
+    config_data = bytearray(b"\xff" * 0x8000)
+    config_data[0x100:0x106] = b"AM057N"
+    sim = simulator.HXSimulator(mode="CP", config=config_data)
+    sim.start()
+
+    port = SimpleNamespace(serial_number="0123", location="1-1.1")
+    key = cache.DeviceIdentityCache.key(port)
+    hx = device.HXSim(sim.tty, port_info=port)
+    assert identities.get(key)["mode"] == "CP"
+    firmware_version = identities.get(key)["firmware_version"]
+    assert hx.comm.firmware_version == firmware_version
+    assert hx.check_flash_id()
+    assert identities.get(key)["flash_id"] == "AM057N", "verified flash ID is remembered"
+    block_size = hx.comm.transfer_block_size()
+    assert identities.get(key)["block_size"] == block_size, "probed block size is remembered"
+
+    identities.update(key, firmware_version="9.99")
+    hx = device.HXSim(sim.tty, port_info=port)
+    assert hx.comm.firmware_version == "9.99", "known firmware version isn't queried again"
+    assert hx.comm.transfer_block_size() == block_size
+    assert hx.comm.stats["read_blocks"] == 0, "known block size isn't probed again"
+    assert hx.comm.get_firmware_version() == firmware_version
+    hx.remember()
+    assert identities.get(key)["firmware_version"] == firmware_version, "fresh answers replace cached ones"
+
+    assert not hx.check_flash_id(["AM063N"])
+    assert identities.get(key) == {}, "mismatch invalidates cache entry"
+
+
+def test_detect_model(kill_sims):
+    del kill_sims
+    config_data = bytearray(b"\xff" * 0x8000)
+    config_data[0x100:0x106] = b"AM063N"
+    sim = simulator.HXSimulator(mode="CP", config=config_data)
+    sim.start()
+
+    hx = device.detect_model(sim.tty)
+    assert type(hx) is device.HX890
+    assert type(hx.config) is device.HX890.config_model, "model is bound to detecting connection"
+    assert hx.comm.stats["read_blocks"] == 1, "flash ID is read once"
+    assert hx.check_flash_id()
+    hx.close()
+
+    sim.c[0x100:0x106] = b"XX000N"
+    assert device.detect_model(sim.tty) is None
+
+
+def test_gps_log_cache_key(kill_sims, tmp_path, monkeypatch):
+    del kill_sims
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(device, "identity_cache", cache.DeviceIdentityCache(str(tmp_path / "devices.json")))
+    sim = simulator.HXSimulator(mode="CP")
+    sim.start()
+
+    ports = [SimpleNamespace(serial_number=None, location=location) for location in ("1-1.1", "1-1.2")]
+    keys = {gpslog.open_cache(device.HXSim(sim.tty, port_info=port)).key for port in ports}
+    assert len(keys) == 2, "unprogrammed radios get separate GPS log caches"
+    assert gpslog.open_cache(device.HXSim(sim.tty)).key == cache.cache_key("", "FFFFFFFFF")
+
+
+def test_untrusted_identity(kill_sims, tmp_path, monkeypatch):
+    del kill_sims
+    identities = cache.DeviceIdentityCache(str(tmp_path / "devices.json"))
+    monkeypatch.setattr(device, "identity_cache", identities)
+    sim = simulator.HXSimulator(mode="CP")
+    sim.start()
+
+    port = SimpleNamespace(serial_number=None, location="1-1.1")
+    identities.update(cache.DeviceIdentityCache.key(port), model="HXSIM", firmware_version="9.99")
+    hx = device.HXSim(sim.tty, port_info=port)
+    assert hx.comm.firmware_version != "9.99", "entries without USB serial number aren't trusted"
+
+    hx.model_verified = False
+    assert not hx.verify_model(), "cached model is verified by flash ID before writing"
+    assert hx.comm.stats["read_blocks"] == 1
+    assert not hx.verify_model()
+    assert hx.comm.stats["read_blocks"] == 1, "flash ID is read only once"
@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
 
+from binascii import unhexlify
+from json import loads
 import pytest
+from struct import pack
+
+from hxtool import locus
 
 from hxtool.main import main
 from hxtool.device import HXSim
 from hxtool.simulator import HXSimulator
 
 
+def gps_log_sector(start: int, waypoints: int = 50) -> bytes:
+    """LOCUS log sector with one waypoint every five seconds"""
+    sector = unhexlify("0100010B7F0000000500000000007A0B") + b"\xff" * 0x30
+    for i in range(waypoints):
+        record = pack("<IBffhHH", start + 5 * i, 2, 52.5 + i / 1000, 13.4 + i / 1000, 40, 3, 90)
+        sector += record + bytes([locus.checksum(record)])
+    return sector + b"\xff" * (0x1000 - len(sector))
+
+
 @pytest.fixture(name="kill_sims")
 def kill_simulator_threads_fixture():
     yield None
@@ -120,10 +134,9 @@ def test_hxtool_atis_mmsi(capsys, kill_sims):
     assert ret == 0, "hxtool atis/mmsi writing and reset returns 0"
 
     outerr = capsys.readouterr()
-    assert """CP simulator processing message b'#CEPWR\\t00B0\\t06\\tFFFFFFFFFF00\\t04\\r\\n'""" in outerr.err
-    assert """CP simulator processing message b'#CEPWR\\t00B6\\t06\\tFFFFFFFFFF00\\t02\\r\\n'""" in outerr.err
-    assert """CP simulator processing message b'#CEPWR\\t00B6\\t06\\t912345678901\\t0B\\r\\n'""" in outerr.err
-    assert """CP simulator processing message b'#CEPWR\\t00B0\\t06\\t123456789002\\t07\\r\\n'""" in outerr.err
+    assert outerr.err.count("CP simulator processing message b'#CEPWR") == 1, "changes are written together"
+    assert """CP simulator processing message b'#CEPWR\\t00B0\\t0C\\t123456789002912345678901\\t7B\\r\\n'""" \
+        in outerr.err
 
 
 @pytest.mark.slow
@@ -178,3 +191,67 @@ def test_hxtool_config_flash(tmpdir, kill_sims):
     ]
     ret = main(args)
     assert ret == 0, "hxtool --simulator -t 0 config --flash returns 0"
+
+
+def test_hxtool_batch(tmpdir, capsys, kill_sims):
+    del kill_sims
+    conf_file = tmpdir.mkdir("config_dump").join("config-{device}.dat")
+
+    args = [
+        "--simulator",
+        "--all",
+        "config",
+        "-d", str(conf_file)
+    ]
+    ret = main(args)
+    assert ret != 0, "hxtool --simulator --all config --dump fails for the NMEA simulator"
+
+    summary = loads(capsys.readouterr().out)
+    assert summary["command"] == "config"
+    cp_report, nmea_report = summary["devices"][:2]
+    assert cp_report["device"] == 0 and cp_report["result"] == 0
+    assert nmea_report["device"] == 1 and nmea_report["result"] == 11
+    assert summary["seconds"] >= max(report["seconds"] for report in summary["devices"])
+    with open(str(conf_file).replace("{device}", "0"), mode="rb") as f:
+        assert len(f.read()) == 1 << 15, "{device} keeps output files apart"
+
+    ret = main(["--simulator", "--all", "info"])
+    assert ret == 0
+    reports = loads(capsys.readouterr().out)["devices"]
+    assert all(report["output"].startswith("Model:\t") for report in reports), "device output is captured"
+
+    assert main(["--simulator", "--all", "nmea"]) == 5, "streaming commands don't run in batch mode"
+
+    shared_file = str(tmpdir.join("config.dat"))
+    assert main(["--simulator", "--all", "config", "-d", shared_file]) == 5, "output files must differ per device"
+    assert not tmpdir.join("config.dat").exists()
+
+
+def test_hxtool_gpslog(tmp_path, monkeypatch, capsys, kill_sims):
+    del kill_sims
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(HXSimulator, "gps_log_default", gps_log_sector(1562677769))
+
+    def gpslog(name, *args):
+        json_file = tmp_path / f"{name}.json"
+        ret = main(["--simulator", "-t", "0", "gpslog", "-j", str(json_file)] + list(args))
+        assert ret == 0, f"hxtool gpslog {' '.join(args)} returns 0"
+        with open(json_file) as f:
+            return [trackpoint["utc_time"] for trackpoint in loads(f.read())["trackpoints"]]
+
+    assert len(gpslog("first")) == 50
+    assert "Reading GPS log from handset" in capsys.readouterr().err
+
+    assert len(gpslog("unchanged")) == 50
+    assert "GPS log unchanged since last read" in capsys.readouterr().err, "unchanged log is taken from cache"
+
+    monkeypatch.setattr(HXSimulator, "gps_log_default", gps_log_sector(1562677769) + gps_log_sector(1562777769))
+    times = gpslog("new", "--new")
+    assert "Reading GPS log from handset" in capsys.readouterr().err
+    assert times[0] == 1562777769 and len(times) == 50, "only new log sector is exported"
+
+    times = gpslog("range", "--since", "1562677769", "--until", "1562777769")
+    assert "GPS log unchanged since last read" in capsys.readouterr().err
+    assert times[0] == 1562677769 and len(times) == 50, "only waypoints within time range are exported"
+    times = gpslog("since", "--since", "1562777774")
+    assert times[0] == 1562777774 and len(times) == 49
@@ -645,3 +645,81 @@ def test_locus_parser_with_sectors():
         assert "latitude" in wp
         assert "longitude" in wp
         assert "height" in wp
+
+
+def test_valid_records():
+    record = unhexlify("0992245D02200952422861574130000D0027019D")
+    broken = unhexlify("0992245D02200952422861574130000D002701FF")
+    assert locus.valid_records(record * 3, len(record)) == 3
+    assert locus.valid_records(record * 3 + record[:-1], len(record)) == 3, "Incomplete records are ignored"
+    assert locus.valid_records(record * 2 + b"\xff" * 20 + record, len(record)) == 2, "Records end at empty slot"
+    assert locus.valid_records(record + b"\x00" * 20 + record, len(record)) == 1, "Records end at zeroed slot"
+    assert locus.valid_records(record * 2 + broken + record, len(record)) == 2, "Records end at bad checksum"
+    assert locus.valid_records(record * 2 + broken + record, len(record), verify=False) == 4
+    assert locus.valid_records(b"", len(record)) == 0
+
+
+@pytest.mark.parametrize("data", [SAMPLE_DAT, SAMPLE_DAT_WITH_SECTORS], ids=["single", "sectors"])
+def test_columnar_parser(data):
+    loc = locus.Locus(data, verify=True)
+    columns = locus.parse_columns(data, verify=True)
+    assert len(columns) == len(loc)
+    assert columns.attributes == list(locus.locus_content_descriptor(0x7f)["attributes"])
+    for i, wp in enumerate(loc):
+        for attribute in wp:
+            assert columns[attribute][i] == wp[attribute], f"{attribute} of waypoint {i} is correct"
+    last = loc[len(loc) - 1]
+    assert list(columns.rows())[-1] == {k: last[k] for k in last}
+
+
+def test_round_trip():
+    header_data = unhexlify("0100010B7F0000000500000000007A0B")
+    assert bytes(locus.LocusHeader(header_data)) == header_data
+    data = unhexlify("0992245D02200952422861574130000D0027019D")
+    wp = locus.LocusWaypoint(0x7f, data)
+    assert bytes(wp) == data
+    wp["height"] = 49
+    assert bytes(wp) != data
+    assert locus.LocusWaypoint(0x7f, bytes(wp))["height"] == 49, "Modified waypoint has valid checksum"
+    assert locus.locus_content_descriptor(0x7f) is locus.locus_content_descriptor(0x7f), "Descriptors are cached"
+
+
+def test_lazy_access():
+    loc = locus.Locus(SAMPLE_DAT_WITH_SECTORS, verify=True)
+    assert all(sector._log is None for sector in loc.sectors), "no waypoints decoded on construction"
+    assert [header.LogContent for header in loc.headers] == [0x7f] * len(loc.sectors)
+
+    waypoints = list(loc)
+    assert loc[-1]["utc_time"] == waypoints[-1]["utc_time"]
+    assert loc[-len(loc)]["utc_time"] == waypoints[0]["utc_time"]
+    with pytest.raises(IndexError):
+        _ = loc[-len(loc) - 1]
+    for index in 0, 1, len(loc) // 2, len(loc) - 1:
+        assert bytes(loc[index]) == bytes(waypoints[index])
+    for item in slice(None), slice(10, 200), slice(-50, None), slice(5, 100, 7), slice(20, 10):
+        assert [bytes(wp) for wp in loc[item]] == [bytes(wp) for wp in waypoints[item]]
+
+    sector_index, index = loc.locate(len(loc.sectors[0]))
+    assert (sector_index, index) == (1, 0), "first waypoint of second sector"
+
+    columns = loc.columns()
+    assert list(columns["utc_time"]) == [wp["utc_time"] for wp in waypoints]
+
+
+def test_time_range():
+    loc = locus.Locus(SAMPLE_DAT_WITH_SECTORS, verify=True)
+    times = [wp["utc_time"] for wp in loc]
+    start = times[len(times) // 3]
+    end = times[2 * len(times) // 3]
+    expected = [t for t in times if start <= t < end]
+    assert len(expected) > 0
+
+    assert [wp["utc_time"] for wp in loc.between(start, end)] == expected
+    assert [wp["utc_time"] for wp in loc.between()] == times
+    assert [wp["utc_time"] for wp in loc.between(end)] == [t for t in times if t >= end]
+    assert list(loc.between(times[-1] + 1)) == []
+    assert list(loc.columns(start, end)["utc_time"]) == expected
+
+    for sector_index in loc.time_sectors(start, end):
+        low, high = loc.time_index[sector_index]
+        assert high >= start and low < end
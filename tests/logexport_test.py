@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, load, loads
+import pytest
+from struct import pack
+import sys
+from xml.etree import ElementTree
+
+from hxtool import locus, logexport
+from hxtool.cli.base import ThreadOutput
+
+
+def make_log(sectors: int = 2, waypoints: int = 100, start: int = 1562677769, interval: int = 5,
+             content: int = 0x7f) -> bytes:
+    """Synthetic LOCUS log, with the usual 0x7f log content or a leading part of it"""
+    header = pack("<HBBHHHHHB", 1, 1, 0x0b, content, 0, 5, 0, 0, 0x7a)
+    header += bytes([locus.checksum(header)]) + b"\xff" * 0x30
+    size = locus.locus_content_descriptor(content)["size"]
+    data = b""
+    t = start
+    for _ in range(sectors):
+        sector = header
+        for i in range(waypoints):
+            record = pack("<IBffhHH", t, 2, 52.5 + i / 1000, 13.4 + i / 1000, 40 + i % 7, i % 20, (i * 7) % 360)
+            record = record[:size]
+            sector += record + bytes([locus.checksum(record)])
+            t += interval
+        data += sector + b"\xff" * (0x1000 - len(sector))
+    return data
+
+
+SAMPLE_LOG = make_log()
+
+
+@pytest.fixture(name="log_data")
+def fixture_log_data():
+    yield logexport.LogData(locus.Locus(SAMPLE_LOG), SAMPLE_LOG)
+
+
+def test_log_data(log_data):
+    assert len(log_data.columns) == len(log_data.log)
+    assert next(log_data.rows())["utc_time"] == log_data.log[0]["utc_time"]
+    blank = logexport.LogData(None, b"\xff" * 0x1000)
+    assert blank.is_blank()
+    assert list(blank.rows()) == []
+
+
+def test_mixed_content_export(tmp_path):
+    raw = make_log(sectors=1) + make_log(sectors=1, start=1562777769, content=0x0f)
+    data = logexport.LogData(locus.Locus(raw), raw, since=1562677769)
+    assert data.columns is None
+    assert isinstance(data.error, locus.LocusError)
+
+    sinks = [logexport.RawSink(str(tmp_path / "log.raw")), logexport.JsonSink(str(tmp_path / "log.json"))]
+    assert logexport.export(data, sinks) == 10, "sinks needing decoded waypoints fail"
+    assert (tmp_path / "log.raw").read_bytes() == raw, "raw export still works"
+    assert not (tmp_path / "log.json").exists()
+    assert logexport.export(data, [logexport.TextSink(None)]) == 10
+
+
+def test_sink_fan_out(log_data, tmp_path, capsys):
+    assert set(logexport.LogSink.sinks) >= {"gpx", "json", "raw"}
+    sinks = [sink_class(str(tmp_path / f"log.{name}")) for name, sink_class in logexport.LogSink.sinks.items()]
+    sinks.append(logexport.TextSink(None))
+    assert logexport.export(log_data, sinks) == 0
+
+    with open(tmp_path / "log.json") as f:
+        assert len(load(f)["trackpoints"]) == len(log_data.log)
+    assert (tmp_path / "log.raw").read_bytes() == SAMPLE_LOG
+    assert (tmp_path / "log.gpx").read_text().count("<trkpt") == len(log_data.log)
+    assert len(capsys.readouterr().out.splitlines()) == len(log_data.log)
+
+    failing = logexport.JsonSink(str(tmp_path / "missing" / "log.json"))
+    assert logexport.export(log_data, [failing]) == 10, "write errors are reported"
+
+
+def test_streaming_gpx(tmp_path):
+    # Two sectors with an hour of silence between them
+    raw = make_log(sectors=1, start=1562677769) + make_log(sectors=1, start=1562677769 + 3600)
+    data = logexport.LogData(locus.Locus(raw), raw)
+    file_name = tmp_path / "log.gpx"
+    sink = logexport.GpxSink(str(file_name))
+    sink.chunk_size = 7
+    assert sink.export(data) == 0
+
+    ns = {"gpx": "http://www.topografix.com/GPX/1/1",
+          "gpxtpx": "http://www.garmin.com/xmlschemas/TrackPointExtension/v2"}
+    root = ElementTree.parse(str(file_name)).getroot()
+    segments = root.findall("gpx:trk/gpx:trkseg", ns)
+    assert [len(segment.findall("gpx:trkpt", ns)) for segment in segments] == [100, 100], "segment split on time gap"
+
+    point = segments[0].findall("gpx:trkpt", ns)[3]
+    wp = data.log[3]
+    assert abs(float(point.get("lat")) - wp["latitude"]) < 1E-6
+    assert abs(float(point.get("lon")) - wp["longitude"]) < 1E-6
+    assert point.find("gpx:ele", ns).text == str(wp["height"])
+    assert point.find("gpx:time", ns).text == "2019-07-09T13:09:44Z"
+    assert point.find("gpx:extensions/gpxtpx:TrackPointExtension/gpxtpx:speed", ns).text == str(wp["speed"])
+    assert point.find("gpx:extensions/gpxtpx:TrackPointExtension/gpxtpx:course", ns).text == str(wp["heading"])
+
+    logexport.GpxSink(str(file_name), segment_gap=7200).export(data)
+    root = ElementTree.parse(str(file_name)).getroot()
+    assert len(root.findall("gpx:trk/gpx:trkseg", ns)) == 1
+
+
+def test_gpxpy_fallback(log_data, tmp_path):
+    gpxpy = pytest.importorskip("gpxpy")
+    file_name = tmp_path / "log.gpx"
+    assert logexport.GpxpySink(str(file_name)).export(log_data) == 0
+    with open(file_name) as f:
+        assert len(gpxpy.parse(f).tracks[0].segments[0].points) == len(log_data.log)
+
+
+def test_streaming_json(log_data, tmp_path):
+    expected = {"trackpoints": list(log_data.rows())}
+
+    for chunk_size in 7, 50:  # 200 trackpoints end in a partial and in a full chunk
+        sink = logexport.JsonSink(str(tmp_path / "log.json"))
+        sink.chunk_size = chunk_size
+        assert sink.export(log_data) == 0
+        assert (tmp_path / "log.json").read_text() == dumps(expected, indent=4), "same layout as json.dump"
+
+    logexport.JsonSink(str(tmp_path / "compact.json"), compact=True).export(log_data)
+    assert (tmp_path / "compact.json").read_text() == dumps(expected, separators=(",", ":"))
+
+    sink = logexport.NdjsonSink(str(tmp_path / "log.ndjson"))
+    sink.chunk_size = 7
+    sink.export(log_data)
+    lines = (tmp_path / "log.ndjson").read_text().splitlines()
+    assert [loads(line) for line in lines] == expected["trackpoints"]
+
+    # Non-finite numbers are formatted by the json module
+    columns = log_data.columns
+    columns["latitude"][5] = float("nan")
+    records = [loads(record) for record in logexport._json_records(columns, compact=True)]
+    assert records[5]["latitude"] != records[5]["latitude"]
+    assert records[6]["latitude"] == columns["latitude"][6]
+
+    columns = locus.LocusColumns(0x7f)
+    with open(tmp_path / "empty.json", "w") as f:
+        logexport.JsonSink(None).write(columns, f)
+    assert loads((tmp_path / "empty.json").read_text()) == {"trackpoints": []}
+
+
+def test_captured_export(log_data, capsys):
+    # Batch mode captures each device's output, including sinks running on export's own threads
+    output = ThreadOutput(sys.stdout)
+
+    def device_worker(_):
+        output.capture()
+        logexport.export(log_data, [logexport.TextSink(None)])
+        return output.release()
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            captured = list(pool.map(device_worker, range(2)))
+    finally:
+        sys.stdout = output.stream
+    assert [len(text.splitlines()) for text in captured] == [len(log_data.log)] * 2
+    assert capsys.readouterr().out == "", "nothing leaks to the real stdout"
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from functools import reduce
+from random import getrandbits
 import pytest
 
-from hxtool.protocol import Message, ProtocolError
+from hxtool.protocol import Message, MessageDecoder, ProtocolError, xor_checksum
 
 
 def test_unary_cmd_message_parser():
@@ -186,3 +188,63 @@ def test_nmea_lowercase_edge_case():
     # calculated with that letter's lowercase byte representation.
     msg = "$PMTKLOG,1,1,b,127,60,0,0,1,1,0*26\r\n"
     assert Message(parse=msg).checksum == "26", "Lowercase NMEA edge case is observed"
+
+
+def test_message_decoder():
+    d = MessageDecoder()
+    stream = b"@#CMDOK\r\n#CEPDT\t0100\t0A\t414D3035374E32FFFFFF\t11\r\nP$PMTK001,183,3*3A\r\n"
+
+    # Feeding the stream byte by byte must give the same result as feeding it at once
+    items = []
+    for i in range(len(stream)):
+        items += list(d.feed(stream[i:i + 1]))
+    assert items == list(MessageDecoder().feed(stream))
+    assert d.pending() == 0, "Decoder keeps no leftovers after complete messages"
+
+    assert items[0] == b"@", "Stray bytes before messages are passed on"
+    assert items[1] == Message("#CMDOK")
+    assert items[2] == Message("#CEPDT", ["0100", "0A", "414D3035374E32FFFFFF"])
+    assert items[3] == b"P", "Stray bytes between messages are passed on"
+    assert items[4] == Message("$PMTK", ["001", "183", "3"])
+    assert len(items) == 5
+
+    # Partial messages are kept between calls
+    assert list(d.feed(b"#CMD")) == []
+    assert d.pending() == 4
+    assert list(d.feed(b"OK\r")) == []
+    assert list(d.feed(b"\n#CMDSY\r\n")) == [Message("#CMDOK"), Message("#CMDSY")]
+
+
+def test_message_decoder_errors():
+    d = MessageDecoder()
+    items = d.feed(b"#CMDOK\r\n$\xff\r\n#CMDSY\r\n")
+    assert next(items) == Message("#CMDOK")
+    with pytest.raises(ProtocolError):
+        next(items)
+    assert list(d.decode()) == [Message("#CMDSY")], "Decoding continues after broken message"
+
+
+def test_xor_checksum():
+    assert xor_checksum(b"") == 0
+    for size in range(1, 300):
+        data = bytes(getrandbits(8) for _ in range(size))
+        assert xor_checksum(data) == reduce(lambda x, y: x ^ y, data), f"XOR checksum correct for {size} bytes"
+
+
+def test_message_cache():
+    m = Message("#CEPDT", ["0100", "0A", "414D3035374E32FFFFFF"])
+    assert bytes(m) == b"#CEPDT\t0100\t0A\t414D3035374E32FFFFFF\t11\r\n"
+    m.args = ["1100", "0A", "414D3035374E32FFFFFF"]
+    assert m.checksum == "10", "Checksum is recalculated after changing args"
+    assert bytes(m) == b"#CEPDT\t1100\t0A\t414D3035374E32FFFFFF\t10\r\n", "Encoding is rebuilt after changing args"
+    m.type = "#CEPDX"
+    assert m.checksum == "1C", "Checksum is recalculated after changing type"
+
+    msg = b"#CEPDT\t0100\t0A\t414D3035374E32FFFFFF\t22\r\n"
+    m = Message(parse=msg)
+    assert bytes(m) == msg, "Received messages encode as received"
+    m.checksum_recv = None
+    assert bytes(m) == b"#CEPDT\t0100\t0A\t414D3035374E32FFFFFF\t11\r\n", "Dropping received checksum re-encodes"
+
+    with pytest.raises(AttributeError):
+        m.foo = "bar"
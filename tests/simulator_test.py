@@ -8,7 +8,8 @@ from threading import enumerate
 from time import sleep
 
 from hxtool import simulator
-from hxtool.protocol import GenericHXProtocol
+from hxtool.tty import GenericHXTTY
+from hxtool.protocol import GenericHXProtocol, MediaTekProtocol
 
 # The simulator doesn't work on Windows, so skip test if running on Windows
 if platform.startswith("win"):
@@ -156,6 +157,30 @@ def test_cp_simulator(cp_sim, kill_sims):
     assert s.read(1) == b"@", "Simulator still signals CP mode"
 
 
+def test_buffered_tty(cp_sim, kill_sims):
+    del kill_sims
+
+    t = GenericHXTTY(cp_sim.tty, timeout=0.5)
+
+    # Several replies arriving in one burst are split into lines
+    t.write(b"?#CMDSY\r\n#CMDSY\r\n#CMDSY\r\n")
+    assert t.read(1) == b"@", "Single bytes are read from buffer"
+    assert t.read_line() == b"#CMDOK\r\n"
+    assert t.read_line() == b"#CMDOK\r\n"
+    assert t.read_line() == b"#CMDOK\r\n"
+
+    with pytest.raises(TimeoutError):
+        t.read_line()
+
+    t.write(b"#CMDSY\r\n")
+    while t.available() < 8:
+        sleep(0.01)
+    t.flush_input()
+    assert t.available() == 0, "Flushing input clears read buffer"
+    with pytest.raises(TimeoutError):
+        t.read(1)
+
+
 @pytest.mark.skip
 def test_cp_config_rw(cp_sim, kill_sims):
     del kill_sims
@@ -167,3 +192,18 @@ def test_cp_config_rw(cp_sim, kill_sims):
     p.write_config_memory(0x1000, random_bytes)
     m = p.read_config_memory(0x1000, len(random_bytes))
     assert m == random_bytes
+
+
+def test_gps_log_sectors(kill_sims):
+    del kill_sims
+    gps_log = bytes(getrandbits(8) for _ in range(3 * 0x1000 + 0x123))
+    sim = simulator.HXSimulator(mode="CP", loop_delay=0.0001, gps_log=gps_log)
+    sim.start()
+    gps = MediaTekProtocol(GenericHXProtocol(sim.tty))
+
+    sectors = list(gps.read_log_sectors())
+    assert [offset for _, offset, _ in sectors] == [0x0000, 0x1000, 0x2000, 0x3000]
+    assert [len(data) for _, _, data in sectors] == [0x1000, 0x1000, 0x1000, 0x123]
+    assert [line_number for line_number, _, _ in sectors] == [42, 85, 127, 131], "sectors yielded when complete"
+    assert b"".join(data for _, _, data in sectors) == gps_log
+    assert gps.read_log() == gps_log